@@ -1,28 +1,40 @@
 import os
 import io
+import atexit
 import base64
+import hashlib
+import importlib.util
+import inspect
 import sqlite3
 import subprocess
 import shutil
 import sys
-import importlib
 import re
 import uuid
+import xmlrpc.client
 import zipfile
+import queue
+import socket
+import tempfile
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime, timedelta
-from typing import Dict, Optional, List, Tuple
+from pathlib import Path
+from typing import Callable, Dict, Iterator, Optional, List, Tuple
 import streamlit as st
 import streamlit.components.v1 as components
+from streamlit.errors import StreamlitAPIException
 import pandas as pd
 from docx import Document
-from docx.enum.text import WD_COLOR_INDEX, WD_ALIGN_PARAGRAPH
+from docx.enum.text import WD_ALIGN_PARAGRAPH
 from docx.text.run import Run
 from docx.oxml.shared import OxmlElement, qn
 from docx.document import Document as DocxDocument
 from docx.table import _Cell, Table
 from docx.text.paragraph import Paragraph
 from docx.shared import Inches
-from docx2pdf import convert as docx2pdf_convert
 
 # ---------------------------
 # Constants and configuration
@@ -38,6 +50,8 @@ PDF_DIR = os.path.join(OUTPUT_DIR, "pdf")
 AGREEMENT_DIR = os.path.join(OUTPUT_DIR, "agreements")
 FEASIBILITY_DIR = os.path.join(AGREEMENT_DIR, "feasibility")
 AGREEMENT_PDF_DIR = os.path.join(AGREEMENT_DIR, "pdf")
+# Served by Streamlit at /app/static/pdf/ (server.enableStaticServing); must sit next to this script
+STATIC_PDF_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static", "pdf")
 
 # Custom exceptions
 class DuplicateAgreementError(Exception):
@@ -55,8 +69,112 @@ QUOTATION_START_NUMBER = 793  # corresponds to 0001
 # Utility: database
 # ---------------------------
 
-def get_conn() -> sqlite3.Connection:
-    conn = sqlite3.connect(DB_PATH)
+# Per-connection settings (these reset on every connect)
+SQLITE_PRAGMAS = (
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-65536",  # ~64 MB page cache
+    "PRAGMA mmap_size=268435456",  # read pages straight from a 256 MB memory map
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA foreign_keys=ON",
+)
+
+
+DB_READER_POOL_SIZE = 4
+
+
+def _open_conn(read_only: bool = False) -> sqlite3.Connection:
+    # Autocommit mode: transactions are opened explicitly where needed
+    if read_only:
+        # Readers can never take the write lock, so they never queue behind (or block) the writer
+        conn = sqlite3.connect(
+            f"{Path(DB_PATH).as_uri()}?mode=ro", uri=True, isolation_level=None, check_same_thread=False
+        )
+    else:
+        conn = sqlite3.connect(DB_PATH, isolation_level=None, check_same_thread=False)
+    for pragma in SQLITE_PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+class _ConnectionPool:
+    """One dedicated writer connection plus a queue of read-only reader connections.
+    Shared by all Streamlit sessions; the schema is created once when the pool is built.
+    All writes go through the writer under writer_lock, so they are applied one at a time.
+    """
+
+    def __init__(self, readers: int):
+        self.writer = _open_conn()
+        # WAL lets the UI keep listing invoices while a quotation is being written.
+        # The journal mode is stored in the database file, so it is set once here, not per connection.
+        self.writer.execute("PRAGMA journal_mode=WAL")
+        self.writer_lock = threading.Lock()
+        # Bumped on every invoices write; cached invoice queries are keyed on it
+        self.invoices_gen = 0
+        # Take the write lock up-front so schema setup never hits SQLITE_BUSY mid-way
+        with with_tx(self.writer):
+            _create_schema(self.writer)
+        self.readers: "queue.Queue[sqlite3.Connection]" = queue.Queue()
+        for _ in range(readers):
+            conn = _open_conn(read_only=True)
+            # Parse the schema now so the first page load doesn't pay for it
+            conn.execute("SELECT count(*) FROM sqlite_master").fetchone()
+            self.readers.put(conn)
+
+
+@st.cache_resource(show_spinner=False)
+def _get_pool() -> _ConnectionPool:
+    return _ConnectionPool(DB_READER_POOL_SIZE)
+
+
+@contextmanager
+def get_reader() -> Iterator[sqlite3.Connection]:
+    """Check a read connection out of the pool for the duration of the block."""
+    pool = _get_pool()
+    conn = pool.readers.get()
+    try:
+        yield conn
+    finally:
+        pool.readers.put(conn)
+
+
+@contextmanager
+def get_writer() -> Iterator[sqlite3.Connection]:
+    """Hold the single writer connection for the duration of the block."""
+    pool = _get_pool()
+    with pool.writer_lock:
+        conn = pool.writer
+        try:
+            yield conn
+        finally:
+            # Never hand the writer back with a half-open transaction
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+
+
+@contextmanager
+def with_tx(conn: sqlite3.Connection) -> Iterator[sqlite3.Connection]:
+    """Run the block as one BEGIN IMMEDIATE ... COMMIT transaction (one WAL sync).
+    Connections are in autocommit mode, so single statements need no wrapper."""
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+
+
+def _invoices_changed() -> None:
+    """Invalidate cached invoice queries (call while holding the writer)."""
+    _get_pool().invoices_gen += 1
+
+
+def _invoices_gen() -> int:
+    return _get_pool().invoices_gen
+
+
+def _create_schema(conn: sqlite3.Connection) -> None:
     conn.execute(
         """
         CREATE TABLE IF NOT EXISTS invoices (
@@ -77,7 +195,8 @@ def get_conn() -> sqlite3.Connection:
             docx_path TEXT,
             pdf_path TEXT,
             created_at TEXT,
-            updated_at TEXT
+            updated_at TEXT,
+            content_hash TEXT
         )
         """
     )
@@ -89,8 +208,15 @@ def get_conn() -> sqlite3.Connection:
             conn.execute("ALTER TABLE invoices ADD COLUMN application_reference TEXT")
         if "electricity_connection_no" not in cols:
             conn.execute("ALTER TABLE invoices ADD COLUMN electricity_connection_no TEXT")
+        if "content_hash" not in cols:
+            conn.execute("ALTER TABLE invoices ADD COLUMN content_hash TEXT")
     except Exception:
         pass
+    # Indexes backing the invoice search/dashboard filters
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_inv_date ON invoices(date_of_quotation)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_inv_product ON invoices(product)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_inv_cust_nocase ON invoices(customer_name COLLATE NOCASE)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_inv_mobile ON invoices(mobile)")
     # New: agreements table to store feasibility uploads and generated agreements
     conn.execute(
         """
@@ -116,28 +242,56 @@ def get_conn() -> sqlite3.Connection:
         )
         """
     )
-    return conn
+    # Sequence counters; 'qno' holds the last issued quotation number, 'agr-YYYYMM' the last
+    # agreement number of that month.
+    # Seeded once from existing invoices so upgraded databases continue their numbering.
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS counters (
+            name TEXT PRIMARY KEY,
+            v INTEGER NOT NULL
+        )
+        """
+    )
+    conn.execute(
+        """
+        INSERT OR IGNORE INTO counters (name, v)
+        SELECT 'qno', COALESCE(MAX(CAST(substr(quotation_no, ?) AS INTEGER)), ?)
+        FROM invoices WHERE quotation_no GLOB ?
+        """,
+        (len(QUOTATION_PREFIX) + 1, QUOTATION_START_NUMBER - 1, f"{QUOTATION_PREFIX}*"),
+    )
 
 # ---------------------------
 # Helpers for quotation number
 # ---------------------------
 
+def _format_quotation_no(n: int) -> str:
+    return f"{QUOTATION_PREFIX}{n:04d}"
+
+
 def next_quotation_no(conn: sqlite3.Connection) -> str:
-    cur = conn.cursor()
-    cur.execute(
-        "SELECT quotation_no FROM invoices WHERE quotation_no LIKE ? ORDER BY id DESC LIMIT 1",
-        (f"{QUOTATION_PREFIX}%",),
-    )
-    row = cur.fetchone()
-    if row and isinstance(row[0], str):
-        try:
-            suffix = int(row[0].split("/")[-1])
-            nxt = suffix + 1
-        except Exception:
-            nxt = QUOTATION_START_NUMBER
-    else:
-        nxt = QUOTATION_START_NUMBER
-    return f"{QUOTATION_PREFIX}{nxt:04d}"
+    """Preview the next quotation number (primary-key read of the counter; nothing is reserved)."""
+    row = conn.execute("SELECT v FROM counters WHERE name = 'qno'").fetchone()
+    last = int(row[0]) if row and row[0] is not None else QUOTATION_START_NUMBER - 1
+    return _format_quotation_no(last + 1)
+
+
+def allocate_quotation_no(conn: sqlite3.Connection) -> str:
+    """Reserve the next quotation number on the writer connection.
+    A single-row UPDATE ... RETURNING, so concurrent creates can never receive the same number.
+    """
+    row = conn.execute("UPDATE counters SET v = v + 1 WHERE name = 'qno' RETURNING v").fetchone()
+    return _format_quotation_no(int(row[0]))
+
+
+def release_quotation_no(conn: sqlite3.Connection, qno: str) -> None:
+    """Give back a reserved number if nothing was issued after it (e.g. generation failed)."""
+    try:
+        n = int(qno[len(QUOTATION_PREFIX):])
+    except Exception:
+        return
+    conn.execute("UPDATE counters SET v = v - 1 WHERE name = 'qno' AND v = ?", (n,))
 
 # ---------------------------
 # File system helpers
@@ -151,30 +305,63 @@ def ensure_dirs():
     os.makedirs(FEASIBILITY_DIR, exist_ok=True)
     os.makedirs(AGREEMENT_PDF_DIR, exist_ok=True)
 
+
+def _remove_quietly(path: Optional[str]) -> None:
+    """Delete a file if it is there; one unlink instead of an exists() check plus remove()."""
+    if not path:
+        return
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+@contextmanager
+def _pdf_staging_dir(target_pdf_path: str) -> Iterator[str]:
+    """Scratch folder next to a target PDF. Converters write there and os.replace() the result
+    onto the target, so a regenerated PDF swaps in atomically and a failed run keeps the old one."""
+    outdir = os.path.dirname(os.path.abspath(target_pdf_path))
+    os.makedirs(outdir, exist_ok=True)
+    tmp = tempfile.mkdtemp(prefix=".convert-", dir=outdir)
+    try:
+        yield tmp
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
 # ---------------------------
 # Helper: upload PDF to transfer.sh
 # ---------------------------
+UPLOAD_CHUNK_SIZE = 64 * 1024
+
+
+@st.cache_resource(show_spinner=False)
+def _http_pool():
+    """Process-wide keep-alive HTTP(S) pool, so repeated calls to the same host (uploads,
+    WhatsApp API) reuse the TCP/TLS connection instead of handshaking each time.
+    urllib3 is already installed as part of Streamlit's requests dependency."""
+    import urllib3
+    return urllib3.PoolManager(maxsize=8, timeout=urllib3.Timeout(total=60), retries=False)
+
 
 def _upload_to_transfersh(file_path: str) -> Optional[str]:
-    """Uploads a file to transfer.sh via HTTP PUT and returns the public URL, or None on failure.
-    Uses only stdlib to avoid new dependencies.
-    """
+    """Uploads a file to transfer.sh via HTTP PUT and returns the public URL, or None on failure."""
     try:
-        import urllib.request as _ur
         filename = os.path.basename(file_path)
         url = f"https://transfer.sh/{filename}"
-        req = _ur.Request(url, method="PUT")
+        # Pass the open file as the body; it is streamed in blocks instead of buffering the PDF
         with open(file_path, "rb") as f:
-            data = f.read()
-        req.add_header("Content-Type", "application/octet-stream")
-        req.add_header("Content-Length", str(len(data)))
-        with _ur.urlopen(req, data=data, timeout=60) as resp:
-            body = resp.read().decode().strip()
-            # transfer.sh usually responds with the final URL in the body
-            if body.startswith("http://") or body.startswith("https://"):
-                return body
-            # Fallback to request URL if a 200 with no body URL
-            return url
+            resp = _http_pool().request("PUT", url, body=f, headers={
+                "Content-Type": "application/octet-stream",
+                "Content-Length": str(os.path.getsize(file_path)),
+            })
+        if resp.status >= 400:
+            return None
+        body = resp.data.decode().strip()
+        # transfer.sh usually responds with the final URL in the body
+        if body.startswith("http://") or body.startswith("https://"):
+            return body
+        # Fallback to request URL if a 200 with no body URL
+        return url
     except Exception:
         return None
 
@@ -226,69 +413,80 @@ def _handle_delete_via_query() -> None:
     try:
         import streamlit as _st
         del_id = _st.query_params.get("delete_id")
-        if del_id:
+        if not del_id:
+            return
+        # Drop only our params; clear()+rerun can race the URL update and re-fire the delete
+        for k in ("delete_id", "ts"):
             try:
-                rid = int(del_id if isinstance(del_id, str) else del_id[0])
-                delete_invoice(rid)
-                _st.success("Deleted.")
-            except Exception as e:
-                _st.error(f"Failed to delete: {e}")
-            finally:
-                # Clear the param and rerun to refresh the list
-                try:
-                    _st.query_params.clear()
-                except Exception:
-                    pass
-                _st.rerun()
+                if k in _st.query_params:
+                    del _st.query_params[k]
+            except Exception:
+                pass
+        try:
+            rid = int(del_id if isinstance(del_id, str) else del_id[0])
+        except Exception:
+            return
+        processed = _st.session_state.setdefault("_deleted_ids", set())
+        if rid in processed:
+            return
+        try:
+            delete_invoice(rid)
+            processed.add(rid)
+            _st.success("Deleted.")
+        except Exception as e:
+            _st.error(f"Failed to delete: {e}")
+        # Rerun to refresh the list
+        _st.rerun()
     except Exception:
         pass
 
 
 
 def _upload_to_fileio(file_path: str) -> Optional[str]:
-    """Upload a file to file.io and return a public URL. Uses stdlib only.
+    """Upload a file to file.io and return a public URL.
     Note: file.io links may expire by default. This is a best-effort fallback.
     """
     try:
         import os as _os
         import json as _json
         import uuid as _uuid
-        import urllib.request as _ur
 
         boundary = f"----WebKitFormBoundary{_uuid.uuid4().hex}"
         filename = _os.path.basename(file_path)
-        with open(file_path, "rb") as f:
-            file_bytes = f.read()
 
-        # Build multipart/form-data body
-        parts = []
-        parts.append(f"--{boundary}\r\n".encode())
-        parts.append(
-            (
-                f"Content-Disposition: form-data; name=\"file\"; filename=\"{filename}\"\r\n"
-                f"Content-Type: application/pdf\r\n\r\n"
-            ).encode()
-        )
-        parts.append(file_bytes)
-        parts.append("\r\n".encode())
+        # Build multipart/form-data body around the file without reading it into memory
+        head = (
+            f"--{boundary}\r\n"
+            f"Content-Disposition: form-data; name=\"file\"; filename=\"{filename}\"\r\n"
+            f"Content-Type: application/pdf\r\n\r\n"
+        ).encode()
         # Optional: set maxDownloads=1 or expiry; we omit to keep default
-        parts.append(f"--{boundary}--\r\n".encode())
-        body = b"".join(parts)
-
-        req = _ur.Request("https://file.io")
-        req.add_header("Content-Type", f"multipart/form-data; boundary={boundary}")
-        req.add_header("Content-Length", str(len(body)))
-        with _ur.urlopen(req, data=body, timeout=60) as resp:
-            raw = resp.read().decode("utf-8", errors="ignore")
-            try:
-                data = _json.loads(raw)
-                url = data.get("link") or data.get("url") or data.get("success")
-                if isinstance(url, str) and (url.startswith("http://") or url.startswith("https://")):
-                    return url
-            except Exception:
-                # Some responses are plain text URL
-                if raw.startswith("http://") or raw.startswith("https://"):
-                    return raw.strip()
+        tail = f"\r\n--{boundary}--\r\n".encode()
+        length = len(head) + _os.path.getsize(file_path) + len(tail)
+
+        def _body(f):
+            yield head
+            for chunk in iter(lambda: f.read(UPLOAD_CHUNK_SIZE), b""):
+                yield chunk
+            yield tail
+
+        with open(file_path, "rb") as f:
+            resp = _http_pool().request("POST", "https://file.io", body=_body(f), headers={
+                "Content-Type": f"multipart/form-data; boundary={boundary}",
+                "Content-Length": str(length),
+            })
+        if resp.status >= 400:
+            return None
+        raw = resp.data.decode("utf-8", errors="ignore")
+        try:
+            data = _json.loads(raw)
+            url = data.get("link") or data.get("url") or data.get("success")
+            if isinstance(url, str) and (url.startswith("http://") or url.startswith("https://")):
+                return url
+        except Exception:
+            # Some responses are plain text URL
+            if raw.startswith("http://") or raw.startswith("https://"):
+                return raw.strip()
         return None
     except Exception:
         return None
@@ -296,19 +494,31 @@ def _upload_to_fileio(file_path: str) -> Optional[str]:
 
 def _get_public_link(file_path: str) -> Optional[str]:
     """Return a cached public URL for the file, uploading if needed.
-    Tries transfer.sh first, falls back to file.io. Caches by absolute path.
+    Uploads to transfer.sh and file.io concurrently and keeps whichever URL arrives first.
+    Caches by absolute path.
     """
     try:
         import os as _os
         import streamlit as _st
+        from concurrent.futures import as_completed
         key = f"public_url::{_os.path.abspath(file_path)}"
         cached = _st.session_state.get(key)
         if cached:
             return cached
-        # Try transfer.sh
-        url = _upload_to_transfersh(file_path)
-        if not url:
-            url = _upload_to_fileio(file_path)
+        url = None
+        pool = ThreadPoolExecutor(max_workers=2)
+        try:
+            futures = [
+                pool.submit(_upload_to_transfersh, file_path),
+                pool.submit(_upload_to_fileio, file_path),
+            ]
+            for fut in as_completed(futures):
+                url = fut.result()
+                if url:
+                    break
+        finally:
+            # Don't wait for the slower upload once we have a link
+            pool.shutdown(wait=False, cancel_futures=True)
         if url:
             _st.session_state[key] = url
         return url
@@ -316,13 +526,112 @@ def _get_public_link(file_path: str) -> Optional[str]:
         return None
 
 
+@st.cache_data(show_spinner=False, ttl=5, max_entries=16)
+def _dir_listing(directory: str, mtime_ns: int) -> frozenset:
+    return frozenset(e.name for e in os.scandir(directory) if e.is_file())
+
+
+def _exists_checker(*dirs: str):
+    """exists(path) answered from one scandir per directory (cached on the directory's mtime)
+    instead of one stat per row; paths outside `dirs` fall back to os.path.exists."""
+    listed: Dict[str, frozenset] = {}
+    for d in dirs:
+        try:
+            listed[os.path.abspath(d)] = _dir_listing(d, os.stat(d).st_mtime_ns)
+        except OSError:
+            listed[os.path.abspath(d)] = frozenset()
+
+    def exists(path: Optional[str]) -> bool:
+        if not path or not isinstance(path, str):
+            return False
+        names = listed.get(os.path.dirname(os.path.abspath(path)))
+        if names is None:
+            return os.path.exists(path)
+        return os.path.basename(path) in names
+
+    return exists
+
+
+# cache_resource, not cache_data: bytes are immutable, so hand out the same object instead of a pickled copy per hit
+@st.cache_resource(show_spinner=False, max_entries=64)
+def _file_bytes_cached(path: str, mtime: float) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def _file_bytes(path: str) -> bytes:
+    """Bytes of a generated file for download buttons, cached by (path, mtime) across reruns."""
+    return _file_bytes_cached(path, os.path.getmtime(path))
+
+
+@st.cache_resource(show_spinner=False, max_entries=32)
+def _pdf_b64(path: str, mtime: float) -> str:
+    """Base64 of a PDF, cached by (path, mtime) so preview and share reuse one read/encode."""
+    return base64.b64encode(_file_bytes_cached(path, mtime)).decode("utf-8")
+
+
+@st.cache_resource(show_spinner=False)
+def _static_pdf_key() -> bytes:
+    """Per-process key for published PDF names. Also clears copies an earlier run published."""
+    shutil.rmtree(STATIC_PDF_DIR, ignore_errors=True)
+    return os.urandom(16)
+
+
+def _published_pdf_dir(path: str) -> str:
+    """Folder holding the published copies (one per version) of one generated PDF."""
+    key = hashlib.blake2b(os.path.abspath(path).encode("utf-8"), key=_static_pdf_key(), digest_size=16)
+    return os.path.join(STATIC_PDF_DIR, key.hexdigest())
+
+
+def _published_pdf_url(path: str, mtime: float) -> Optional[str]:
+    # Unguessable name per (file, version): the URL changes when the PDF is regenerated,
+    # so the browser can cache it for good
+    folder = _published_pdf_dir(path)
+    name = hashlib.blake2b(
+        f"{os.path.abspath(path)}:{mtime}".encode("utf-8"), key=_static_pdf_key(), digest_size=16,
+    ).hexdigest() + ".pdf"
+    dst = os.path.join(folder, name)
+    try:
+        if not os.path.exists(dst):
+            os.makedirs(folder, exist_ok=True)
+            try:
+                os.link(path, dst)
+            except OSError:
+                shutil.copyfile(path, dst)
+    except Exception:
+        return None
+    base = (st.get_option("server.baseUrlPath") or "").strip("/")
+    return "/" + "/".join(p for p in (base, "app/static/pdf", os.path.basename(folder), name) if p)
+
+
+def _unpublish_pdf(path: Optional[str]) -> None:
+    """Take every published copy of a generated PDF offline. Called wherever the PDF is
+    deleted or replaced, so an old or deleted quotation stops being served at once."""
+    if not path:
+        return
+    try:
+        shutil.rmtree(_published_pdf_dir(path), ignore_errors=True)
+    except Exception:
+        pass
+
+
+def _pdf_url(path: str, mtime: float) -> Optional[str]:
+    """Same-origin URL for a generated PDF, or None when static serving is off
+    (callers then inline the PDF as base64)."""
+    try:
+        if not st.get_option("server.enableStaticServing"):
+            return None
+        return _published_pdf_url(path, mtime)
+    except Exception:
+        return None
+
+
 def _render_mobile_share_button(pdf_path: str, filename: Optional[str] = None) -> None:
     """Render a mobile-friendly Share button that shares the actual PDF file via Web Share API.
     Falls back to a normal download link if file sharing is not supported.
     """
     try:
         import os as _os
-        import base64 as _b64
         import streamlit as _st
         import streamlit.components.v1 as _components
 
@@ -330,8 +639,36 @@ def _render_mobile_share_button(pdf_path: str, filename: Optional[str] = None) -
             _st.warning("PDF not found for sharing.")
             return
         name = filename or _os.path.basename(pdf_path) or "invoice.pdf"
-        with open(pdf_path, "rb") as f:
-            b64 = _b64.b64encode(f.read()).decode("utf-8")
+        mtime = _os.path.getmtime(pdf_path)
+        url = _pdf_url(pdf_path, mtime)
+        if url:
+            # Browser fetches (and caches) the file itself; started on pointerdown so the
+            # bytes are usually in hand by the time the click handler calls navigator.share
+            pdf_js = f"""
+          dl.href = "{url}";
+          let pending = null;
+          function loadBlob() {{
+            if (!pending) pending = fetch("{url}").then(r => r.blob()).then(b => new Blob([b], {{ type: 'application/pdf' }}));
+            return pending;
+          }}
+          btn.addEventListener('pointerdown', () => {{ loadBlob().catch(() => {{}}); }});
+          async function pdfBlob() {{ return await loadBlob(); }}"""
+        else:
+            # The PDF is embedded once; the download link gets a blob: URL built from the same bytes
+            pdf_js = f"""
+          const b64 = "{_pdf_b64(pdf_path, mtime)}";
+          let blob = null;
+          function pdfBlob() {{
+            if (!blob) {{
+              const bin = atob(b64);
+              const len = bin.length;
+              const bytes = new Uint8Array(len);
+              for (let i = 0; i < len; i++) bytes[i] = bin.charCodeAt(i);
+              blob = new Blob([bytes], {{ type: 'application/pdf' }});
+              dl.href = URL.createObjectURL(blob);
+            }}
+            return blob;
+          }}"""
 
         html = f"""
         <div style="display:flex; justify-content:center; width:100%">
@@ -346,26 +683,16 @@ def _render_mobile_share_button(pdf_path: str, filename: Optional[str] = None) -
             <span>📤</span>
             <span>Share PDF</span>
           </button>
-          <a id="dlLink" download="{name}" href="data:application/pdf;base64,{b64}" style="display:none">Download</a>
+          <a id="dlLink" download="{name}" style="display:none">Download</a>
         </div>
         <script>
         (function() {{
           const btn = document.getElementById('sharePdfBtn');
           const dl = document.getElementById('dlLink');
-          const b64 = "{b64}";
-          const fname = "{name}";
-          function b64ToBytes(b64) {{
-            const bin = atob(b64);
-            const len = bin.length;
-            const bytes = new Uint8Array(len);
-            for (let i = 0; i < len; i++) bytes[i] = bin.charCodeAt(i);
-            return bytes;
-          }}
+          const fname = "{name}";{pdf_js}
           btn.addEventListener('click', async () => {{
             try {{
-              const bytes = b64ToBytes(b64);
-              const blob = new Blob([bytes], {{ type: 'application/pdf' }});
-              const file = new File([blob], fname, {{ type: 'application/pdf' }});
+              const file = new File([await pdfBlob()], fname, {{ type: 'application/pdf' }});
               if (navigator.canShare && navigator.canShare({{ files: [file] }})) {{
                 await navigator.share({{
                   files: [file],
@@ -378,6 +705,9 @@ def _render_mobile_share_button(pdf_path: str, filename: Optional[str] = None) -
               }}
             }} catch (e) {{
               console.error(e);
+              if (!dl.href) {{
+                try {{ await pdfBlob(); }} catch (_) {{ return; }}
+              }}
               dl.click();
             }}
           }});
@@ -390,15 +720,13 @@ def _render_mobile_share_button(pdf_path: str, filename: Optional[str] = None) -
         pass
 
 
+_ILLEGAL_FILENAME_MAP = str.maketrans({c: "-" for c in '\\/:*?"<>|'})
+
+
 def safe_filename(name: str) -> str:
     """Return a filesystem-safe filename fragment (no path separators or illegal chars)."""
-    illegal = ['\\\\', '/', ':', '*', '?', '"', '<', '>', '|']
-    safe = name
-    for ch in illegal:
-        safe = safe.replace(ch, '-')
-    # Collapse spaces and trim
-    safe = " ".join(safe.split())
-    return safe
+    # Single translate pass, then collapse spaces and trim
+    return " ".join(name.translate(_ILLEGAL_FILENAME_MAP).split())
 
 # ---------------------------
 # Helper: WhatsApp Cloud API send (optional)
@@ -415,8 +743,6 @@ def _wa_send_document_via_cloud_api(
     """Send a document message using WhatsApp Cloud API. Returns (ok, msg)."""
     try:
         import json as _json
-        import urllib.request as _ur
-        import urllib.error as _ue
 
         url = f"https://graph.facebook.com/v20.0/{phone_number_id}/messages"
         payload = {
@@ -430,19 +756,14 @@ def _wa_send_document_via_cloud_api(
             },
         }
         data = _json.dumps(payload).encode("utf-8")
-        req = _ur.Request(url, data=data, method="POST")
-        req.add_header("Authorization", f"Bearer {token}")
-        req.add_header("Content-Type", "application/json")
-        try:
-            with _ur.urlopen(req, timeout=60) as resp:
-                _ = resp.read()
-                return True, "Sent via WhatsApp API."
-        except _ue.HTTPError as e:
-            try:
-                err_body = e.read().decode()
-            except Exception:
-                err_body = str(e)
+        resp = _http_pool().request("POST", url, body=data, headers={
+            "Authorization": f"Bearer {token}",
+            "Content-Type": "application/json",
+        })
+        if resp.status >= 400:
+            err_body = resp.data.decode(errors="replace") or f"HTTP {resp.status}"
             return False, f"API error: {err_body}"
+        return True, "Sent via WhatsApp API."
     except Exception as ex:
         return False, f"Failed: {ex}"
 
@@ -450,33 +771,112 @@ def _wa_send_document_via_cloud_api(
 # DOCX processing - replace only yellow highlighted runs
 # ---------------------------
 
-def iter_paragraphs_and_cells(doc: DocxDocument) -> List[Paragraph]:
-    items: List[Paragraph] = []
+# Labels recognised by replace_by_labels(): (label, form data key, formatter).
+# Formatter: None = as entered, "line" = single line, "date" = DD/MM/YYYY, "str" = str().
+# Several labels share a key (e.g. all phone/mobile aliases read "mobile").
+_LABEL_DISPATCH = (
+    ("customer name", "customer_name", None),
+    ("location", "location", "line"),
+    ("city", "city", None),
+    ("state", "state", None),
+    # Explicit pincode labels (handle both single word and spaced variant)
+    ("pincode", "pincode", None),
+    ("pin code", "pincode", None),
+    # Support multiple possible labels used in templates for phone/mobile/customer no
+    ("phone", "mobile", None),
+    ("customer no", "mobile", None),
+    ("mobile no", "mobile", None),
+    ("mobile number", "mobile", None),
+    ("product & service", "product", None),
+    ("date of quotation", "date_of_quotation", "date"),
+    ("validity of quotation", "validity_date", "date"),
+    ("quotation no", "quotation_no", "str"),
+    ("application reference", "application_reference", None),
+    ("electricity connection no", "electricity_connection_no", None),
+)
+QUOTATION_LABELS = tuple(label for label, _, _ in _LABEL_DISPATCH)
+# Form fields that end up in the rendered quotation (staff_name etc. are DB-only)
+_TEMPLATE_KEYS = tuple(dict.fromkeys(key for _, key, _ in _LABEL_DISPATCH))
+_LABEL_SOURCE = {label: (key, fmt) for label, key, fmt in _LABEL_DISPATCH}
+# Labels for which we should remove the title text (customer info block only)
+_STRIP_LABELS = frozenset([
+    "customer name", "location", "city", "state",
+    "pincode", "pin code",
+    "phone", "customer no", "mobile no", "mobile number",
+])
+# Matches any label followed by ':' or '-' in lowercased paragraph text.
+# Longest alternatives first so e.g. 'mobile number' is not cut short by 'mobile no'.
+LABEL_RE = re.compile(
+    "(" + "|".join(re.escape(l) for l in sorted(QUOTATION_LABELS, key=len, reverse=True)) + r")([:\-])"
+)
+
+
+_W_HIGHLIGHT = qn("w:highlight")
+_W_VAL = qn("w:val")
+
+
+# replace_by_labels pads the value before these labels when another label shares their line
+_GAP_NEEDLES = ("date of quotation", "validity of quotation")
+
+# What pass 1 of replace_by_labels learns from a template, by paragraph position:
+# (paragraph count, ((index, lowercased text, labels present), ...), (placeholder-only indexes, ...))
+LabelPlan = Tuple[int, Tuple[Tuple[int, str, Tuple[str, ...]], ...], Tuple[int, ...]]
+
+
+def _label_plan(paras: List[Paragraph]) -> LabelPlan:
+    """A single lowercase scan per paragraph records which labels it holds.
+    Most template paragraphs hold none and are skipped entirely by replace_by_labels."""
+    labelled: List[Tuple[int, str, Tuple[str, ...]]] = []
+    # Unlabelled paragraphs that may still hold 'replace ... here' placeholders
+    placeholders: List[int] = []
+    for i, p in enumerate(paras):
+        tl = p.text.lower()
+        found = {m.group(1) for m in LABEL_RE.finditer(tl)}
+        present = tuple(label for label in QUOTATION_LABELS if label in found)
+        if present or any(n in tl for n in _GAP_NEEDLES):
+            labelled.append((i, tl, present))
+        elif "replace" in tl:
+            placeholders.append(i)
+    return len(paras), tuple(labelled), tuple(placeholders)
+
+
+def _is_yellow(run: Run) -> bool:
+    # Read <w:rPr><w:highlight w:val="yellow"/> straight off the run element; run.font.highlight_color
+    # builds a Font proxy and maps the value through the enum on every probe
+    try:
+        rpr = run._r.rPr
+        if rpr is None:
+            return False
+        hl = rpr.find(_W_HIGHLIGHT)
+        return hl is not None and hl.get(_W_VAL) == "yellow"
+    except Exception:
+        # Some runs might not have highlight attribute accessible
+        return False
+
+
+def iter_paragraphs_and_cells(doc: DocxDocument) -> Iterator[Paragraph]:
+    """Yield body paragraphs, then table cell paragraphs (one level of nested tables).
+    Lazy: single-pass callers never hold the whole list; list() it to walk more than once."""
     # Paragraphs at document level
-    items.extend(doc.paragraphs)
+    yield from doc.paragraphs
     # Paragraphs inside tables
     for table in doc.tables:
         for row in table.rows:
             for cell in row.cells:
-                items.extend(cell.paragraphs)
+                yield from cell.paragraphs
                 # Also nested tables inside a cell
                 for tbl in cell.tables:
                     for r in tbl.rows:
                         for c in r.cells:
-                            items.extend(c.paragraphs)
-    return items
+                            yield from c.paragraphs
 
 
 def get_yellow_runs(doc: DocxDocument) -> List[Run]:
     yellow_runs: List[Run] = []
     for p in iter_paragraphs_and_cells(doc):
         for run in p.runs:
-            try:
-                if run.font.highlight_color == WD_COLOR_INDEX.YELLOW:
-                    yellow_runs.append(run)
-            except Exception:
-                # Some runs might not have highlight attribute accessible
-                pass
+            if _is_yellow(run):
+                yellow_runs.append(run)
     return yellow_runs
 
 
@@ -488,7 +888,10 @@ def replace_yellow_fields(doc: DocxDocument, values_in_order: List[str]) -> None
             run.text = str(values_in_order[i])
 
 
-def replace_by_labels(doc: DocxDocument, data: Dict[str, str]) -> None:
+def replace_by_labels(
+    doc: DocxDocument, data: Dict[str, str], paras: Optional[List[Paragraph]] = None,
+    plan: Optional[LabelPlan] = None,
+) -> None:
     """Replace highlighted values based on paragraph labels to avoid misaligned fields.
     Labels handled:
     - Customer Name:
@@ -509,109 +912,83 @@ def replace_by_labels(doc: DocxDocument, data: Dict[str, str]) -> None:
         except Exception:
             return val or ""
 
-    targets = {
-        "customer name": data.get("customer_name", ""),
-        "location": data.get("location", "").replace("\n", " ").strip(),
-        "city": data.get("city", ""),
-        "state": data.get("state", ""),
-        # Explicit pincode labels (handle both single word and spaced variant)
-        "pincode": data.get("pincode", ""),
-        "pin code": data.get("pincode", ""),
-        # Support multiple possible labels used in templates for phone/mobile/customer no
-        "phone": data.get("mobile", ""),
-        "customer no": data.get("mobile", ""),
-        "mobile no": data.get("mobile", ""),
-        "mobile number": data.get("mobile", ""),
-        "product & service": data.get("product", ""),
-        "date of quotation": fmt_date(data.get("date_of_quotation", "")),
-        "validity of quotation": fmt_date(data.get("validity_date", "")),
-        "quotation no": str(data.get("quotation_no", "")),
-        # New fields
-        "application reference": data.get("application_reference", ""),
-        "electricity connection no": data.get("electricity_connection_no", ""),
-    }
-
-    # Labels for which we should remove the title text (customer info block only)
-    STRIP_LABELS = set([
-        "customer name", "location", "city", "state",
-        "pincode", "pin code",
-        "phone", "customer no", "mobile no", "mobile number",
-    ])
-
-    def replace_in_paragraph(p: Paragraph, label: str, value: str, all_labels: List[str]):
-        text = p.text
-        text_lower = text.lower()
-        # detect label with ':' or '-'
-        candidates = [f"{label}:", f"{label}-"]
-        label_start = -1
-        label_end = -1
-        for cand in candidates:
-            idx = text_lower.find(cand)
-            if idx != -1:
-                label_start = idx
-                label_end = idx + len(cand)
-                break
-        if label_start == -1:
+    # Values are resolved lazily, once per form field, for the labels a paragraph actually holds
+    resolved: Dict[str, str] = {}
+
+    def target_value(label: str) -> str:
+        key, fmt = _LABEL_SOURCE[label]
+        if key not in resolved:
+            raw = data.get(key, "")
+            if fmt == "line":
+                raw = raw.replace("\n", " ").strip()
+            elif fmt == "date":
+                raw = fmt_date(raw)
+            elif fmt == "str":
+                raw = str(raw)
+            resolved[key] = raw
+        return resolved[key]
+
+    def replace_in_paragraph(p: Paragraph, label: str, value: str, runs_info: List[list], runs_only: bool):
+        # runs_info is the paragraph's [run, text] list, shared by all its labels and kept in sync
+        # on each write. When the paragraph is nothing but runs (no hyperlinks etc.), its text is
+        # just their concatenation and p.text need not be re-walked per label.
+        text = "".join(ri[1] for ri in runs_info) if runs_only else p.text
+        # All label positions in one regex pass: (start, end, label, separator)
+        matches = [(m.start(), m.end(), m.group(1), m.group(2)) for m in LABEL_RE.finditer(text.lower())]
+        own = [m for m in matches if m[2] == label]
+        # detect label with ':' first, then '-'
+        hit = next((m for m in own if m[3] == ":"), None) or next((m for m in own if m[3] == "-"), None)
+        if hit is None:
             return  # label not in this paragraph
+        label_start, label_end = hit[0], hit[1]
 
-        # find the next other label occurrence to bound our clearing range
-        next_idx = len(text)
-        for other in all_labels:
-            if other == label:
-                continue
-            for sep in (":", "-"):
-                i = text_lower.find(f"{other}{sep}", label_end)
-                if i != -1:
-                    next_idx = min(next_idx, i)
-        # iterate runs and find first yellow run whose run range begins after label_end and before next_idx
-        pos = 0
+        # the next other label occurrence bounds our clearing range
+        next_idx = min((m[0] for m in matches if m[2] != label and m[0] >= label_end), default=len(text))
+
+        def spans():
+            pos = 0
+            for ri in runs_info:
+                begin = pos
+                pos += len(ri[1])
+                yield ri, begin, pos
+
+        def set_text(ri, txt: str) -> None:
+            ri[0].text = txt
+            ri[1] = txt
+
+        def value_text() -> str:
+            val_txt = str(value)
+            # Add a trailing space for specific labels that are followed by another label on the same line
+            if label in ("application reference", "electricity connection no") and not val_txt.endswith(" "):
+                val_txt = val_txt + " "
+            return val_txt
+
+        # Only runs overlapping (label_end, next_idx) can hold this label's value
+        region = [ri for ri, begin, end in spans() if end > label_end and begin < next_idx]
+
+        # find first yellow run in the region; later yellow runs there are leftover placeholders
         replaced = False
-        for r in p.runs:
-            rt = r.text
-            begin = pos
-            end = pos + len(rt)
-            pos = end
-            if end <= label_end:
+        for ri in region:
+            if not _is_yellow(ri[0]):
                 continue
-            if begin >= next_idx:
-                break
             try:
-                if r.font.highlight_color == WD_COLOR_INDEX.YELLOW:
-                    if not replaced:
-                        # Add a trailing space for specific labels that are followed by another label on the same line
-                        if value is None:
-                            r.text = ""
-                        else:
-                            val_txt = str(value)
-                            if label in ("application reference", "electricity connection no") and not val_txt.endswith(" "):
-                                val_txt = val_txt + " "
-                            r.text = val_txt
-                        replaced = True
-                    else:
-                        # clear leftover highlighted placeholders in this label's region
-                        r.text = ""
+                if not replaced:
+                    set_text(ri, "" if value is None else value_text())
+                    replaced = True
+                else:
+                    # clear leftover highlighted placeholders in this label's region
+                    set_text(ri, "")
             except Exception:
                 pass
 
         # Fallback when there are no highlighted placeholders: replace 'N/A' or set first run after label
         if not replaced and value:
-            pos = 0
             fallback_done = False
-            for r in p.runs:
-                rt = r.text
-                begin = pos
-                end = pos + len(rt)
-                pos = end
-                if end <= label_end:
-                    continue
-                if begin >= next_idx:
-                    break
+            for ri in region:
+                rt = ri[1]
                 if "N/A" in rt or "n/a" in rt.lower() or rt.strip() == "":
                     try:
-                        val_txt = str(value)
-                        if label in ("application reference", "electricity connection no") and not val_txt.endswith(" "):
-                            val_txt = val_txt + " "
-                        r.text = val_txt
+                        set_text(ri, value_text())
                         fallback_done = True
                         break
                     except Exception:
@@ -619,43 +996,73 @@ def replace_by_labels(doc: DocxDocument, data: Dict[str, str]) -> None:
             if not fallback_done:
                 # As last resort, append the value at end of paragraph
                 try:
-                    val_txt = str(value)
-                    if label in ("application reference", "electricity connection no") and not val_txt.endswith(" "):
-                        val_txt = val_txt + " "
-                    p.add_run(" " + val_txt)
+                    tail = " " + value_text()
+                    runs_info.append([p.add_run(tail), tail])
                 except Exception:
                     pass
 
         # Second pass: remove the label text portion itself ONLY for customer info labels
-        if label in STRIP_LABELS:
-            pos = 0
-            for r in p.runs:
-                rt = r.text
-                begin = pos
-                end = pos + len(rt)
-                pos = end
+        if label in _STRIP_LABELS:
+            for ri, begin, end in list(spans()):
                 # full overlap with label => clear
                 if end <= label_end and end > label_start:
-                    r.text = ""
+                    set_text(ri, "")
                 # partial overlap => trim the label part
                 elif begin < label_end < end:
                     keep_from = label_end - begin
                     try:
-                        r.text = rt[keep_from:]
+                        set_text(ri, ri[1][keep_from:])
                     except Exception:
                         pass
 
-    search_paras = iter_paragraphs_and_cells(doc)
-    label_list = list(targets.keys())
-    for p in search_paras:
+    search_paras = paras if paras is not None else list(iter_paragraphs_and_cells(doc))
+
+    # Pass 1: which paragraphs hold which labels. `plan` (precomputed once per template by
+    # _template_label_plan) skips the scan; it only applies to an untouched copy of that template.
+    if plan is None or plan[0] != len(search_paras):
+        plan = _label_plan(search_paras)
+    label_index = [(search_paras[i], tl, present) for i, tl, present in plan[1]]
+    placeholder_paras = [search_paras[i] for i in plan[2]]
+
+    # Placeholder cleanup for one paragraph:
+    # - remove any leftover demo placeholders like 'replace ... here'
+    # - otherwise replace explicit highlighted phrases found in updated 3.3 kW template
+    #   so that values don't concatenate with the right-side labels.
+    phrase_map = {
+        "replace application reference here": data.get("application_reference", ""),
+        "replace electricity connection here": data.get("electricity_connection_no", ""),
+    }
+
+    def clear_placeholders(p: Paragraph) -> None:
+        for r in p.runs:
+            try:
+                if _is_yellow(r):
+                    txt = (r.text or "").strip()
+                    low = txt.lower()
+                    if low.startswith("replace"):
+                        r.text = ""
+                        continue
+                    for ph, val in phrase_map.items():
+                        if ph in low and val:
+                            v = str(val)
+                            # ensure a non-breaking space at the end to separate from next label
+                            if not v.endswith(" "):
+                                v = v + "\u00A0"
+                            r.text = v
+                            break
+            except Exception:
+                pass
+
+    # Pass 2: replace only the labels found. Offsets are still resolved per label because
+    # stripping one label's title shifts the positions of the next one in the same paragraph.
+    for p, tl, present in label_index:
         # Combined State and Pincode in same paragraph special-case still supported
-        tl = p.text.lower()
-        if ("state:" in tl or "state-" in tl) and ("pincode" in tl or "pin code" in tl):
+        if "state" in present and ("pincode" in tl or "pin code" in tl):
             values = [data.get("state", ""), data.get("pincode", "")]
             idx = 0
             for r in p.runs:
                 try:
-                    if r.font.highlight_color == WD_COLOR_INDEX.YELLOW:
+                    if _is_yellow(r):
                         if idx < len(values):
                             r.text = str(values[idx])
                             idx += 1
@@ -691,7 +1098,7 @@ def replace_by_labels(doc: DocxDocument, data: Dict[str, str]) -> None:
                         if candidate_after is None:
                             candidate_after = r
                         try:
-                            if r.font.highlight_color == WD_COLOR_INDEX.YELLOW and candidate_after_highlight is None:
+                            if _is_yellow(r) and candidate_after_highlight is None:
                                 candidate_after_highlight = r
                         except Exception:
                             pass
@@ -705,77 +1112,55 @@ def replace_by_labels(doc: DocxDocument, data: Dict[str, str]) -> None:
                         except Exception:
                             pass
             # continue with other labels too (in case paragraph also contains others)
-        # Do scoped replacement for each label
-        for label, value in targets.items():
-            replace_in_paragraph(p, label, value, label_list)
+        # Do scoped replacement for each label; run texts are read once per paragraph
+        runs_info = [[r, r.text] for r in p.runs]
+        runs_only = "".join(ri[1] for ri in runs_info) == p.text
+        for label in present:
+            replace_in_paragraph(p, label, target_value(label), runs_info, runs_only)
 
         # Ensure a visible gap before right-side labels when they appear in the same paragraph
         # (seen in the 3.3 kW template where 'Application Reference' and 'Date of Quotation' can share a line)
         try:
-            para_text = p.text
+            para_text = "".join(ri[1] for ri in runs_info) if runs_only else p.text
             if para_text:
-                for needle in ("date of quotation", "validity of quotation"):
+                for needle in _GAP_NEEDLES:
                     idx = para_text.lower().find(needle)
                     if idx > 0 and para_text[idx-1] not in (" ", "\u00A0", "\t"):
                         # Find the run that begins at or covers 'idx' and prefix a non-breaking space
                         pos = 0
-                        for r in p.runs:
+                        for ri in runs_info:
                             begin = pos
-                            end = pos + len(r.text)
+                            end = pos + len(ri[1])
                             pos = end
                             if begin <= idx < end or (begin == idx == end and end == 0):
                                 try:
-                                    rt = r.text or ""
+                                    rt = ri[1] or ""
                                     if not rt.startswith((" ", "\u00A0")):
-                                        r.text = "\u00A0" + rt
+                                        ri[0].text = "\u00A0" + rt
+                                        ri[1] = ri[0].text
                                 except Exception:
                                     pass
                                 break
         except Exception:
             pass
 
-    # Final cleanup: remove any leftover demo placeholders like 'replace ... here'
-    for p in search_paras:
-        for r in p.runs:
-            try:
-                if r.font.highlight_color == WD_COLOR_INDEX.YELLOW and r.text.strip().lower().startswith("replace"):
-                    r.text = ""
-            except Exception:
-                pass
+        clear_placeholders(p)
 
-    # Additional safety: replace explicit highlighted phrases found in updated 3.3 kW template
-    # so that values don't concatenate with the right-side labels.
-    phrase_map = {
-        "replace application reference here": data.get("application_reference", ""),
-        "replace electricity connection here": data.get("electricity_connection_no", ""),
-    }
-    for p in search_paras:
-        for r in p.runs:
-            try:
-                if r.font.highlight_color == WD_COLOR_INDEX.YELLOW:
-                    txt = (r.text or "").strip()
-                    low = txt.lower()
-                    for ph, val in phrase_map.items():
-                        if ph in low and val:
-                            v = str(val)
-                            # ensure a non-breaking space at the end to separate from next label
-                            if not v.endswith(" "):
-                                v = v + "\u00A0"
-                            r.text = v
-                            break
-            except Exception:
-                pass
+    # Paragraphs without labels were not touched above, so only those that already held
+    # 'replace' text can have placeholders left
+    for p in placeholder_paras:
+        clear_placeholders(p)
 
 
-def clear_all_highlights(doc: DocxDocument) -> None:
-    """Remove highlight formatting from all runs in the document (paragraphs and tables)."""
-    for p in iter_paragraphs_and_cells(doc):
-        for r in p.runs:
-            try:
-                # Setting to None clears any highlight color
-                r.font.highlight_color = None
-            except Exception:
-                pass
+def clear_all_highlights(doc: DocxDocument, paras: Optional[List[Paragraph]] = None) -> None:
+    """Remove highlight formatting from all runs in the document (paragraphs and tables).
+    One XPath finds the <w:highlight> elements directly instead of probing every run;
+    `paras` is accepted for call-site compatibility and no longer needed."""
+    for hl in doc.element.body.xpath(".//w:r/w:rPr/w:highlight"):
+        try:
+            hl.getparent().remove(hl)
+        except Exception:
+            pass
 
 # ---------------------------
 # Core required functions
@@ -789,137 +1174,254 @@ def _template_for_product(product: str) -> str:
     # default to 3.3 template
     return TEMPLATE_PATH
 
-def create_invoice(form_data: Dict[str, str], template_path: str) -> Tuple[Optional[str], Optional[str]]:
+def create_invoice(form_data: Dict[str, str], template_path: str) -> Tuple[Optional[str], Optional[str], str]:
     """Create invoice: generate DOCX (temporary), convert to PDF, save DB record.
-    Returns (None, pdf_path or None if conversion failed). We no longer persist DOCX files.
+    Returns (None, pdf_path or None if conversion failed, quotation_no). We no longer persist DOCX files.
     """
     ensure_dirs()
-    conn = get_conn()
+    with get_writer() as conn:
+        qno = allocate_quotation_no(conn)
     try:
-        qno = next_quotation_no(conn)
-        form_data = dict(form_data)
-        form_data["quotation_no"] = qno
-
-        # Prepare values order for highlighted replacements
-        # Order assumption based on the template sample provided:
-        # [customer_name, location, city, state, pincode, mobile, product, quotation_no, date_of_quotation, validity_date]
-        values = [
-            form_data.get("customer_name", ""),
-            form_data.get("location", ""),
-            form_data.get("city", ""),
-            form_data.get("state", ""),
-            form_data.get("pincode", ""),
-            form_data.get("mobile", ""),
-            form_data.get("product", ""),
-            form_data.get("quotation_no", ""),
-            form_data.get("date_of_quotation", ""),
-            form_data.get("validity_date", ""),
-        ]
+        docx_path, pdf_path = _create_invoice_with_number(form_data, template_path, qno)
+    except BaseException:
+        with get_writer() as conn:
+            release_quotation_no(conn, qno)
+        raise
+    return docx_path, pdf_path, qno
 
-        docx_bytes = generate_docx(values, form_data, template_path)
-        # Save DOCX temporarily (needed for conversion) – will delete after PDF is created
-        # Use only Quotation No for file naming so one quotation -> one PDF file consistently
-        safe_qno = safe_filename(form_data["quotation_no"]) if form_data.get("quotation_no") else "qno"
-        base_name = f"{safe_qno}"
-        docx_path = os.path.join(DOCX_DIR, f"{base_name}.docx")
-        # Safe overwrite if file exists
-        try:
-            if os.path.exists(docx_path):
-                os.remove(docx_path)
-        except Exception:
-            pass
-        with open(docx_path, "wb") as f:
-            f.write(docx_bytes.getvalue())
 
-        # Convert to PDF
-        target_pdf = os.path.join(PDF_DIR, f"{base_name}.pdf")
-        try:
-            if os.path.exists(target_pdf):
-                os.remove(target_pdf)
-        except Exception:
-            pass
-        pdf_path = convert_to_pdf(docx_path, target_pdf)
-
-        # Always delete temporary DOCX (do not persist word files)
-        try:
-            if os.path.exists(docx_path):
-                os.remove(docx_path)
-        except Exception:
-            pass
-        persisted_docx_path: Optional[str] = None
-
-        # Save DB
+def _content_hash(form_data: Dict[str, str], template_path: str) -> str:
+    """Fingerprint of everything that affects the rendered PDF (template fields + template file)."""
+    try:
+        st_ = os.stat(template_path)
+        tpl = (os.path.abspath(template_path), st_.st_mtime_ns, st_.st_size)
+    except Exception:
+        tpl = (template_path,)
+    payload = (tpl, tuple(str(form_data.get(k) or "") for k in _TEMPLATE_KEYS))
+    return hashlib.blake2b(repr(payload).encode("utf-8"), digest_size=16).hexdigest()
+
+
+def _invoice_docx(form_data: Dict[str, str], template_path: str) -> io.BytesIO:
+    """Fill the quotation template for one invoice record (form data plus quotation_no)."""
+    # Prepare values order for highlighted replacements
+    # Order assumption based on the template sample provided:
+    # [customer_name, location, city, state, pincode, mobile, product, quotation_no, date_of_quotation, validity_date]
+    values = [
+        form_data.get("customer_name", ""),
+        form_data.get("location", ""),
+        form_data.get("city", ""),
+        form_data.get("state", ""),
+        form_data.get("pincode", ""),
+        form_data.get("mobile", ""),
+        form_data.get("product", ""),
+        form_data.get("quotation_no", ""),
+        form_data.get("date_of_quotation", ""),
+        form_data.get("validity_date", ""),
+    ]
+    return generate_docx(values, form_data, template_path)
+
+
+def _create_invoice_with_number(
+    form_data: Dict[str, str], template_path: str, qno: str
+) -> Tuple[Optional[str], Optional[str]]:
+    form_data = dict(form_data)
+    form_data["quotation_no"] = qno
+
+    docx_bytes = _invoice_docx(form_data, template_path)
+    # Use only Quotation No for file naming so one quotation -> one PDF file consistently
+    safe_qno = safe_filename(form_data["quotation_no"]) if form_data.get("quotation_no") else "qno"
+    base_name = f"{safe_qno}"
+
+    # Convert to PDF straight from memory (DOCX is never persisted)
+    target_pdf = os.path.join(PDF_DIR, f"{base_name}.pdf")
+    pdf_path = convert_docx_bytes_to_pdf(docx_bytes.getbuffer(), target_pdf)
+    persisted_docx_path: Optional[str] = None
+
+    # Save DB
+    with get_writer() as conn:
         save_to_db(conn, {
             **form_data,
             "docx_path": persisted_docx_path,
             "pdf_path": pdf_path,
+            "content_hash": _content_hash(form_data, template_path) if pdf_path else None,
         })
-        return persisted_docx_path, pdf_path
-    finally:
-        conn.close()
+    return persisted_docx_path, pdf_path
+
+
+@st.cache_resource(show_spinner=False, max_entries=16)
+def _pdf_preview_html(pdf_path: str, mtime: float, url: Optional[str]) -> str:
+    """PDF.js viewer markup, built once per (path, mtime, url). PDF.js loads the file from its
+    static URL when static serving is on (url given); otherwise the PDF is inlined as base64.
+    cache_resource hands back the same (immutable) string on every rerun."""
+    if url:
+        source_js = f"const source = {{ url: '{url}' }};"
+    else:
+        source_js = f"""const pdfData = atob('{_pdf_b64(pdf_path, mtime)}');
+        const bytes = new Uint8Array(pdfData.length);
+        for (let i = 0; i < pdfData.length; i++) bytes[i] = pdfData.charCodeAt(i);
+        const source = {{ data: bytes }};"""
+    # Minimal PDF.js renderer: sized placeholders for every page, pages painted only when scrolled into view
+    return f"""
+    <div id="pdf_root"></div>
+    <script src="https://unpkg.com/pdfjs-dist@3.11.174/build/pdf.min.js"></script>
+    <script>
+    (function() {{
+        {source_js}
+        const CMAP_URL = 'https://unpkg.com/pdfjs-dist@3.11.174/cmaps/';
+        // Parse/render in the PDF.js worker instead of on the iframe's main thread
+        window['pdfjsLib'].GlobalWorkerOptions.workerSrc = 'https://unpkg.com/pdfjs-dist@3.11.174/build/pdf.worker.min.js';
+        const ROOT = document.getElementById('pdf_root');
+        ROOT.style.border = '1px solid #e5e7eb';
+        ROOT.style.borderRadius = '10px';
+        ROOT.style.padding = '8px';
+        const loadingTask = window['pdfjsLib'].getDocument(Object.assign(source, {{ cMapUrl: CMAP_URL, cMapPacked: true }}));
+        loadingTask.promise.then(function(pdf) {{
+            const scale = 1.1;
+            const renderPage = function(num, holder) {{
+                pdf.getPage(num).then(function(page) {{
+                    const viewport = page.getViewport({{ scale }});
+                    const canvas = document.createElement('canvas');
+                    canvas.style.display = 'block';
+                    const context = canvas.getContext('2d');
+                    canvas.height = viewport.height;
+                    canvas.width = viewport.width;
+                    holder.style.width = viewport.width + 'px';
+                    holder.style.height = viewport.height + 'px';
+                    holder.appendChild(canvas);
+                    page.render({{ canvasContext: context, viewport: viewport }});
+                }});
+            }};
+            // Size every placeholder from page 1 (quotations are uniform A4) so the scrollbar is right up front
+            pdf.getPage(1).then(function(first) {{
+                const vp = first.getViewport({{ scale }});
+                const observer = new IntersectionObserver(function(entries) {{
+                    for (const e of entries) {{
+                        if (e.isIntersecting) {{
+                            observer.unobserve(e.target);
+                            renderPage(+e.target.dataset.num, e.target);
+                        }}
+                    }}
+                }}, {{ rootMargin: '200px 0px' }});
+                for (let i = 1; i <= pdf.numPages; i++) {{
+                    const holder = document.createElement('div');
+                    holder.className = 'page';
+                    holder.dataset.num = String(i);
+                    holder.style.width = vp.width + 'px';
+                    holder.style.height = vp.height + 'px';
+                    holder.style.margin = '0 auto 8px auto';
+                    ROOT.appendChild(holder);
+                    observer.observe(holder);
+                }}
+            }});
+        }}).catch(function(err) {{
+            ROOT.innerHTML = '<div style="color:#ef4444">Failed to load preview.</div>';
+            console.error(err);
+        }});
+    }})();
+    </script>
+    """
+
+
+@st.cache_resource(show_spinner=False)
+def _pdfium_lock() -> threading.Lock:
+    """PDFium is not thread-safe, not even across documents, and every session's script runs
+    in its own thread. Process-wide lock (a module-level one would be rebuilt every rerun)."""
+    return threading.Lock()
+
+
+@st.cache_data(show_spinner=False, max_entries=32)
+def _pdf_first_page_png(pdf_path: str, mtime: float) -> Optional[Tuple[bytes, int]]:
+    """(PNG of page 1, page count), rendered server-side with pypdfium2 when it is installed."""
+    try:
+        import pypdfium2 as pdfium
+    except ImportError:
+        return None
+    # The PIL image shares the bitmap's buffer, so encode before the bitmap is freed; every
+    # PDFium object is also closed explicitly here rather than by a finalizer on some other thread
+    buf = io.BytesIO()
+    with _pdfium_lock():
+        pdf = pdfium.PdfDocument(pdf_path)
+        try:
+            page = pdf[0]
+            try:
+                bitmap = page.render(scale=1.5)
+                try:
+                    bitmap.to_pil().save(buf, "PNG")
+                finally:
+                    bitmap.close()
+            finally:
+                page.close()
+            pages = len(pdf)
+        finally:
+            pdf.close()
+    return buf.getvalue(), pages
+
+
+def _show_all_pages(state_key: str) -> None:
+    st.session_state[state_key] = True
 
 
 def _render_pdf_preview(pdf_path: str, height: int = 700) -> None:
-    """Render a PDF inline using PDF.js to avoid Chrome blocking the built-in viewer in sandboxed iframes."""
+    """Render a PDF inline. By default only page 1 is shown, as a server-rendered image;
+    PDF.js (which avoids Chrome blocking the built-in viewer in sandboxed iframes) is
+    loaded for "View all pages", or whenever pypdfium2 is unavailable."""
     try:
-        with open(pdf_path, "rb") as f:
-            b64 = base64.b64encode(f.read()).decode("utf-8")
-        # Minimal PDF.js renderer for all pages
-        html = f"""
-        <div id="pdf_root"></div>
-        <script src="https://unpkg.com/pdfjs-dist@3.11.174/build/pdf.min.js"></script>
-        <script>
-        (function() {{
-            const pdfData = atob('{b64}');
-            const bytes = new Uint8Array(pdfData.length);
-            for (let i = 0; i < pdfData.length; i++) bytes[i] = pdfData.charCodeAt(i);
-            const CMAP_URL = 'https://unpkg.com/pdfjs-dist@3.11.174/cmaps/';
-            const ROOT = document.getElementById('pdf_root');
-            ROOT.style.border = '1px solid #e5e7eb';
-            ROOT.style.borderRadius = '10px';
-            ROOT.style.padding = '8px';
-            const loadingTask = window['pdfjsLib'].getDocument({{ data: bytes, cMapUrl: CMAP_URL, cMapPacked: true }});
-            loadingTask.promise.then(function(pdf) {{
-                const scale = 1.1;
-                const renderPage = function(num) {{
-                    pdf.getPage(num).then(function(page) {{
-                        const viewport = page.getViewport({{ scale }});
-                        const canvas = document.createElement('canvas');
-                        canvas.style.display = 'block';
-                        canvas.style.margin = '0 auto 8px auto';
-                        const context = canvas.getContext('2d');
-                        canvas.height = viewport.height;
-                        canvas.width = viewport.width;
-                        ROOT.appendChild(canvas);
-                        page.render({{ canvasContext: context, viewport: viewport }});
-                    }});
-                }};
-                for (let i = 1; i <= pdf.numPages; i++) renderPage(i);
-            }}).catch(function(err) {{
-                ROOT.innerHTML = '<div style="color:#ef4444">Failed to load preview.</div>';
-                console.error(err);
-            }});
-        }})();
-        </script>
-        """
+        mtime = os.path.getmtime(pdf_path)
+        state_key = f"pdf_all_pages::{os.path.abspath(pdf_path)}"
+        first = None if st.session_state.get(state_key) else _pdf_first_page_png(pdf_path, mtime)
+        if first is not None:
+            png, pages = first
+            with st.container(height=height, border=False):
+                st.image(png)
+            if pages > 1:
+                st.button(
+                    f"View all pages ({pages})", key=f"pdf_all_btn::{state_key}",
+                    on_click=_show_all_pages, args=(state_key,),
+                )
+            return
+        # Resolved every run (not inside the cached markup): it republishes a copy that was unpublished
+        html = _pdf_preview_html(pdf_path, mtime, _pdf_url(pdf_path, mtime))
         components.html(html, height=height, scrolling=True)
     except Exception:
         st.warning("Preview not available.")
 
 
+@st.cache_resource(show_spinner=False, max_entries=8)
+def _template_bytes_cached(path: str, mtime: float) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def _template_bytes(path: str) -> bytes:
+    """Raw template file kept in memory so each document skips the disk read.
+    Keyed by mtime, so replacing a template on disk takes effect without a restart."""
+    return _template_bytes_cached(path, os.path.getmtime(path))
+
+
+@st.cache_resource(show_spinner=False, max_entries=8)
+def _template_label_plan(path: str, mtime: float) -> LabelPlan:
+    """replace_by_labels' pass 1 for a template, run once on a pristine copy of it."""
+    doc = Document(io.BytesIO(_template_bytes_cached(path, mtime)))
+    return _label_plan(list(iter_paragraphs_and_cells(doc)))
+
+
 def generate_docx(values_in_order: List[str], form_data: Dict[str, str], template_path: str) -> io.BytesIO:
     if not os.path.exists(template_path):
         raise FileNotFoundError(f"Template not found at {template_path}")
-    doc = Document(template_path)
+    mtime = os.path.getmtime(template_path)
+    doc = Document(io.BytesIO(_template_bytes_cached(template_path, mtime)))
+
+    # Walk body and table paragraphs once; none of the passes below add or remove paragraphs
+    paras = list(iter_paragraphs_and_cells(doc))
 
-    # Replace values by labels for accuracy
-    replace_by_labels(doc, form_data)
+    # Replace values by labels for accuracy (label positions scanned once per template)
+    replace_by_labels(doc, form_data, paras, plan=_template_label_plan(template_path, mtime))
 
     # Normalize layout to minimize LO vs Word differences
-    normalize_layout(doc)
+    normalize_layout(doc, paras)
 
     # Remove any yellow highlighting so final PDF has clean text
-    clear_all_highlights(doc)
+    clear_all_highlights(doc, paras)
 
     bio = io.BytesIO()
     doc.save(bio)
@@ -927,7 +1429,7 @@ def generate_docx(values_in_order: List[str], form_data: Dict[str, str], templat
     return bio
 
 
-def normalize_layout(doc: DocxDocument) -> None:
+def normalize_layout(doc: DocxDocument, paras: Optional[List[Paragraph]] = None) -> None:
     """Stabilize table layout and currency formatting so LibreOffice doesn't wrap unexpectedly.
     - Turn off table autofit so column widths are respected
     - Apply fixed widths to the items table columns when detected
@@ -938,11 +1440,24 @@ def normalize_layout(doc: DocxDocument) -> None:
     # Helper to set entire column width
     def set_col_width(table: Table, col_idx: int, width_in: float):
         w = Inches(width_in)
-        for r in table.rows:
-            try:
-                r.cells[col_idx].width = w
-            except Exception:
-                pass
+        tbl = table._tbl
+        if tbl.xpath("./w:tr/w:tc/w:tcPr/w:gridSpan | ./w:tr/w:tc/w:tcPr/w:vMerge"):
+            # Merged cells: let python-docx map the grid column to the owning cell in each row
+            for r in table.rows:
+                try:
+                    r.cells[col_idx].width = w
+                except Exception:
+                    pass
+            return
+        # No merges, so the Nth <w:tc> of every row is grid column N: set <w:tcW> on the
+        # elements directly instead of building a _Cell tuple per row
+        for tr in tbl.tr_lst:
+            tcs = tr.tc_lst
+            if col_idx < len(tcs):
+                try:
+                    tcs[col_idx].width = w
+                except Exception:
+                    pass
 
     # Helper to set cell margins (in twips). Some PDF renderers collapse column boundaries
     # visually when there is no inner padding; adding small margins improves separation.
@@ -970,13 +1485,11 @@ def normalize_layout(doc: DocxDocument) -> None:
             pass
 
     # Replace rupee+space globally to prevent breaks
-    for p in iter_paragraphs_and_cells(doc):
-        for r in p.runs:
-            try:
-                if "₹ " in r.text:
-                    r.text = r.text.replace("₹ ", "₹\u00A0")
-            except Exception:
-                pass
+    # (this also covers the items-table cells, so the numeric-column pass below only aligns).
+    # One XPath over the body's <w:t> nodes instead of a Run proxy and r.text round-trip per run
+    for t in doc.element.body.xpath(".//w:t"):
+        if t.text and "₹ " in t.text:
+            t.text = t.text.replace("₹ ", "₹\u00A0")
 
     for table in doc.tables:
         try:
@@ -992,37 +1505,40 @@ def normalize_layout(doc: DocxDocument) -> None:
         except Exception:
             headers = []
 
-        if headers and ("item name" in headers or "itemname" in headers) and ("amount" in headers):
+        # First occurrence wins, matching list.index()
+        hdr_idx: Dict[str, int] = {}
+        for i, h in enumerate(headers):
+            hdr_idx.setdefault(h, i)
+
+        if hdr_idx and ("item name" in hdr_idx or "itemname" in hdr_idx) and ("amount" in hdr_idx):
             # Approximate column widths in inches matching an A4 portrait printable width (~6.2in content area)
             # [S.No, Item name, Qty, Price/Unit, GST(%), GST(Amount), Amount]
-            col_widths = [0.5, 3.0, 0.7, 1.0, 0.8, 1.1, 1.1]
-            for idx, w in enumerate(col_widths):
-                if idx < len(table.columns):
-                    set_col_width(table, idx, w)
+            col_widths = [Inches(w) for w in (0.5, 3.0, 0.7, 1.0, 0.8, 1.1, 1.1)][: len(table.columns)]
 
             # Right-align numeric columns
-            num_cols = []
-            for key in ("price/ unit", "price/unit", "gst (amount)", "gst amount", "amount", "gst (%)", "gst%"):
-                if key in headers:
-                    num_cols.append(headers.index(key))
+            num_cols = [
+                hdr_idx[k]
+                for k in ("price/ unit", "price/unit", "gst (amount)", "gst amount", "amount", "gst (%)", "gst%")
+                if k in hdr_idx
+            ]
             # Fallback known positions if headers not matched precisely
             if not num_cols and len(headers) >= 7:
                 num_cols = [3, 4, 5, 6]
+            # One walk over the rows applies both the widths and the numeric alignment
             for r in table.rows:
+                cells = r.cells
+                for idx, w in enumerate(col_widths):
+                    try:
+                        cells[idx].width = w
+                    except Exception:
+                        pass
                 for ci in num_cols:
-                    if ci < len(r.cells):
-                        for p in r.cells[ci].paragraphs:
+                    if ci < len(cells):
+                        for p in cells[ci].paragraphs:
                             try:
                                 p.alignment = WD_ALIGN_PARAGRAPH.RIGHT
                             except Exception:
                                 pass
-                        for p in r.cells[ci].paragraphs:
-                            for run in p.runs:
-                                try:
-                                    if "₹ " in run.text:
-                                        run.text = run.text.replace("₹ ", "₹\u00A0")
-                                except Exception:
-                                    pass
         else:
             # Heuristic for 2-column details table (labels/values block)
             try:
@@ -1098,152 +1614,639 @@ def normalize_layout(doc: DocxDocument) -> None:
             pass
 
 
-def convert_to_pdf(docx_path: str, target_pdf_path: str) -> Optional[str]:
-    # Ensure target directory exists
+# ---------------------------
+# PDF conversion
+# ---------------------------
+UNOSERVER_HOST = "127.0.0.1"
+UNOSERVER_PORT = int(os.environ.get("UNOSERVER_PORT", "2003"))
+UNOSERVER_UNO_PORT = int(os.environ.get("UNOSERVER_UNO_PORT", "2002"))
+UNOSERVER_START_TIMEOUT = 30
+UNOSERVER_CONVERT_TIMEOUT = 60
+# Parallel LibreOffice instances (each has its own profile and ports); also caps concurrent one-shot soffice runs
+LIBREOFFICE_WORKERS = max(1, int(os.environ.get("LIBREOFFICE_WORKERS", "2")))
+
+
+# Detached, fd-clean settings for LibreOffice/unoserver children: no inherited descriptors,
+# no tty, and their own session so terminal signals aren't delivered to them twice.
+_QUIET_CHILD = dict(
+    stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, close_fds=True, start_new_session=True,
+)
+
+def _find_soffice() -> Optional[str]:
+    """Locate soffice once per process; a miss (or a binary that has since vanished) is
+    looked up again so a later install is picked up."""
+    soffice = _locate_soffice()
+    if soffice and os.path.exists(soffice):
+        return soffice
+    _locate_soffice.clear()
+    return _locate_soffice()
+
+
+@st.cache_resource(show_spinner=False)
+def _locate_soffice() -> Optional[str]:
+    # Cached process-wide: a module global would be reset by every Streamlit rerun
+    # Try PATH first
+    soffice = shutil.which("soffice") or shutil.which("soffice.exe")
+    # Allow overriding via environment variable
+    if not soffice:
+        env_lo = os.environ.get("LIBREOFFICE_PATH")
+        if env_lo and os.path.exists(env_lo):
+            soffice = env_lo
+    # Try common Windows install path
+    if not soffice:
+        win_lo = r"C:\\Program Files\\LibreOffice\\program\\soffice.exe"
+        if os.path.exists(win_lo):
+            soffice = win_lo
+    return soffice
+
+
+def _port_open(host: str, port: int) -> bool:
+    try:
+        with socket.create_connection((host, port), timeout=0.5):
+            return True
+    except OSError:
+        return False
+
+
+def _stop_process(proc: subprocess.Popen) -> None:
+    try:
+        if proc.poll() is None:
+            proc.terminate()
+            proc.wait(timeout=10)
+    except Exception:
+        try:
+            proc.kill()
+        except Exception:
+            pass
+
+
+class _UnoWorker:
+    """One unoserver process (plus its soffice) on its own ports and user profile."""
+
+    def __init__(self, index: int, unoserver: str, soffice: str):
+        self.index = index
+        self.port = UNOSERVER_PORT + 10 * index
+        self.uno_port = UNOSERVER_UNO_PORT + 10 * index
+        self.unoserver = unoserver
+        self.soffice = soffice
+        self.proc: Optional[subprocess.Popen] = None
+        # Take the listener (and its soffice child) down with the app; registered once, so restarts don't pile up handlers
+        atexit.register(self.stop)
+
+    def stop(self) -> None:
+        if self.proc is not None:
+            _stop_process(self.proc)
+
+    def start(self) -> None:
+        # Dedicated profile per worker: LibreOffice cannot share one profile between processes
+        profile = os.path.join(tempfile.gettempdir(), f"mierae-unoserver-profile-{self.index}")
+        cmd = [
+            self.unoserver,
+            "--interface", UNOSERVER_HOST,
+            "--port", str(self.port),
+            "--uno-port", str(self.uno_port),
+            "--executable", self.soffice,
+            "--user-installation", Path(profile).as_uri(),
+        ]
+        try:
+            self.proc = subprocess.Popen(cmd, stdin=subprocess.DEVNULL, **_QUIET_CHILD)
+        except Exception:
+            self.proc = None
+
+    def wait_ready(self, deadline: float) -> bool:
+        while self.proc is not None and time.monotonic() < deadline:
+            if self.proc.poll() is not None:
+                return False
+            if _port_open(UNOSERVER_HOST, self.port):
+                return True
+            time.sleep(0.25)
+        if self.proc is not None:
+            _stop_process(self.proc)
+        return False
+
+    def alive(self) -> bool:
+        return self.proc is not None and self.proc.poll() is None
+
+
+class _UnoServerPool:
+    """Fixed set of unoserver workers handed out through a queue, so up to
+    LIBREOFFICE_WORKERS conversions run in parallel and each worker handles one at a time."""
+
+    def __init__(self, workers: List[_UnoWorker], unoconvert: str):
+        self.unoconvert = unoconvert
+        self.idle: "queue.Queue[_UnoWorker]" = queue.Queue()
+        for w in workers:
+            self.idle.put(w)
+
+    @contextmanager
+    def checkout(self) -> Iterator[_UnoWorker]:
+        w = self.idle.get()
+        try:
+            if not w.alive():
+                # Worker died (e.g. soffice crash): restart it in place before use
+                w.start()
+                w.wait_ready(time.monotonic() + UNOSERVER_START_TIMEOUT)
+            yield w
+        finally:
+            self.idle.put(w)
+
+
+@st.cache_resource(show_spinner=False)
+def _get_unoserver_pool() -> Optional[_UnoServerPool]:
+    """Start the long-lived unoserver workers once per process.
+
+    Returns None when unoserver/LibreOffice is not installed or no worker comes up,
+    in which case convert_to_pdf falls back to one-shot soffice runs.
+    """
+    unoserver = shutil.which("unoserver")
+    unoconvert = shutil.which("unoconvert")
+    soffice = _find_soffice()
+    if not unoserver or not unoconvert or not soffice:
+        return None
+    workers = [_UnoWorker(i, unoserver, soffice) for i in range(LIBREOFFICE_WORKERS)]
+    # Launch all first so their startups overlap, then wait for each port
+    for w in workers:
+        w.start()
+    deadline = time.monotonic() + UNOSERVER_START_TIMEOUT
+    ready = [w for w in workers if w.wait_ready(deadline)]
+    if not ready:
+        return None
+    return _UnoServerPool(ready, unoconvert)
+
+
+@st.cache_resource(show_spinner=False)
+def _prewarm_unoserver() -> threading.Thread:
+    """Start the LibreOffice listeners in the background at app startup, so the first
+    conversion does not pay soffice startup. Runs once per process."""
+    t = threading.Thread(target=_get_unoserver_pool, name="unoserver-prewarm", daemon=True)
+    t.start()
+    return t
+
+
+class _TimeoutTransport(xmlrpc.client.Transport):
+    """XML-RPC transport with a socket timeout; the stock one waits forever on a hung soffice."""
+
+    def __init__(self, timeout: float):
+        super().__init__()
+        self.timeout = timeout
+
+    def make_connection(self, host):
+        conn = super().make_connection(host)
+        conn.timeout = self.timeout
+        return conn
+
+
+# Positional arguments of the unoserver XML-RPC convert() call, as named by UnoClient.convert
+UNO_CONVERT_PARAMS = (
+    "inpath", "indata", "outpath", "convert_to", "filtername", "filter_options", "update_index", "infiltername",
+)
+
+
+def _uno_proxy(port: int) -> Optional[xmlrpc.client.ServerProxy]:
+    """In-process XML-RPC proxy to a unoserver worker, or None to go through unoconvert instead: when the
+    unoserver package is not importable here (e.g. the CLI comes from a separate LibreOffice Python), or when
+    its UnoClient.convert no longer takes UNO_CONVERT_PARAMS, i.e. the server's call signature has changed."""
+    if importlib.util.find_spec("unoserver") is None:
+        return None
+    try:
+        from unoserver.client import UnoClient
+        params = tuple(inspect.signature(UnoClient.convert).parameters)[1:]
+    except Exception:
+        return None
+    if params != UNO_CONVERT_PARAMS:
+        return None
+    return xmlrpc.client.ServerProxy(
+        f"http://{UNOSERVER_HOST}:{port}", allow_none=True, transport=_TimeoutTransport(UNOSERVER_CONVERT_TIMEOUT)
+    )
+
+
+def _convert_via_unoserver(
+    docx_path: Optional[str],
+    target_pdf_path: str,
+    data: Optional[bytes | memoryview] = None,
+    pool: Optional[_UnoServerPool] = None,
+) -> bool:
+    """Convert through a running unoserver worker. Pass `data` (with docx_path=None) to send the DOCX bytes directly.
+    Threads without the Streamlit script context must pass `pool`: the cached lookup misses there."""
+    pool = pool or _get_unoserver_pool()
+    if pool is None:
+        return False
+    with pool.checkout() as worker:
+        if not worker.alive():
+            return False
+        src = None if data is not None else os.path.abspath(docx_path)
+        try:
+            with _pdf_staging_dir(target_pdf_path) as tmp:
+                dst = os.path.join(tmp, os.path.basename(target_pdf_path))
+                _unoserver_convert(pool, worker, src, data, dst)
+                os.replace(dst, target_pdf_path)
+        except (socket.timeout, subprocess.TimeoutExpired):
+            # soffice is wedged: stop it so the next checkout restarts this worker
+            if worker.proc is not None:
+                _stop_process(worker.proc)
+            return False
+        except Exception:
+            return False
+    return True
+
+
+def _unoserver_convert(
+    pool: _UnoServerPool, worker: _UnoWorker, src: Optional[str], data: Optional[bytes | memoryview], dst: str
+) -> None:
+    """One conversion on a checked-out worker; raises on failure."""
+    proxy = _uno_proxy(worker.port)
+    if proxy is not None:
+        # Talk to the listener directly instead of starting an unoconvert interpreter per file
+        # XML-RPC can only marshal real bytes
+        indata = bytes(data) if isinstance(data, memoryview) else data
+        args = dict(
+            inpath=src, indata=indata, outpath=dst, convert_to="pdf",
+            filtername=None, filter_options=[], update_index=True, infiltername=None,
+        )
+        with proxy:
+            # XML-RPC has no keyword arguments: send them in the order _uno_proxy checked against UnoClient
+            proxy.convert(*(args[name] for name in UNO_CONVERT_PARAMS))
+    else:
+        cmd = [
+            pool.unoconvert,
+            "--host", UNOSERVER_HOST,
+            "--port", str(worker.port),
+            "--convert-to", "pdf",
+            "-" if data is not None else src,
+            dst,
+        ]
+        subprocess.run(
+            cmd, input=data, stdin=None if data is not None else subprocess.DEVNULL,
+            check=True, timeout=UNOSERVER_CONVERT_TIMEOUT, **_QUIET_CHILD,
+        )
+
+
+@st.cache_resource(show_spinner=False)
+def _soffice_slots() -> "queue.Queue[int]":
+    """One-shot soffice runs: each slot owns a profile dir, and taking a slot from the queue
+    bounds how many cold LibreOffice processes run at once. Cached so every session and rerun
+    shares one queue; a module-level queue would be rebuilt on each script run."""
+    slots: "queue.Queue[int]" = queue.Queue()
+    for slot in range(LIBREOFFICE_WORKERS):
+        slots.put(slot)
+    return slots
+
+
+@st.cache_resource(show_spinner=False)
+def _get_pdf_executor() -> ThreadPoolExecutor:
+    """Background workers for invoice generation/conversion, sized to the LibreOffice pool.
+    Threads (not processes): the heavy lifting happens in LibreOffice subprocesses, and a
+    process pool would re-import this Streamlit script in every worker."""
+    return ThreadPoolExecutor(max_workers=LIBREOFFICE_WORKERS, thread_name_prefix="pdf")
+
+
+def _run_in_background(fn, *args) -> Future:
+    """Submit fn to the PDF executor, carrying the Streamlit script context into the worker thread."""
+    try:
+        from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+        ctx = get_script_run_ctx()
+    except Exception:
+        ctx = None
+
+    def _job():
+        thread = threading.current_thread()
+        if ctx is not None:
+            add_script_run_ctx(thread, ctx)
+        try:
+            return fn(*args)
+        finally:
+            # Pool threads serve every session: don't leave this one's context behind for the next job
+            # (add_script_run_ctx(thread, None) would not clear it)
+            thread.__dict__.pop("streamlit_script_run_ctx", None)
+
+    return _get_pdf_executor().submit(_job)
+
+
+def convert_docx_bytes_to_pdf(docx_bytes: bytes | memoryview, target_pdf_path: str) -> Optional[str]:
+    """Convert an in-memory DOCX to PDF. Accepts a BytesIO.getbuffer() view to avoid copying it.
+    Streams the bytes to unoserver when it is running; otherwise writes a temporary DOCX
+    next to the other generated files, runs convert_to_pdf on it and deletes it.
+    """
     try:
         os.makedirs(os.path.dirname(target_pdf_path), exist_ok=True)
     except Exception:
         pass
-
-    # 1) Try LibreOffice (fast, headless) if available (works on Linux/Streamlit Cloud and Windows if installed)
     try:
-        # Try PATH first
-        soffice = shutil.which("soffice") or shutil.which("soffice.exe")
-        # Allow overriding via environment variable
-        if not soffice:
-            env_lo = os.environ.get("LIBREOFFICE_PATH")
-            if env_lo and os.path.exists(env_lo):
-                soffice = env_lo
-        # Try common Windows install path
-        if not soffice:
-            win_lo = r"C:\\Program Files\\LibreOffice\\program\\soffice.exe"
-            if os.path.exists(win_lo):
-                soffice = win_lo
-        if soffice and os.path.exists(docx_path):
-            outdir = os.path.dirname(target_pdf_path)
-            cmd = [
-                soffice,
-                "--headless",
-                "--convert-to",
-                "pdf",
-                "--outdir",
-                outdir,
-                docx_path,
-            ]
-            subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=60)
-            base = os.path.splitext(os.path.basename(docx_path))[0] + ".pdf"
-            produced = os.path.join(outdir, base)
-            if os.path.exists(produced):
-                if os.path.abspath(produced) != os.path.abspath(target_pdf_path):
-                    try:
-                        if os.path.exists(target_pdf_path):
-                            os.remove(target_pdf_path)
-                    except Exception:
-                        pass
-                    os.replace(produced, target_pdf_path)
-                return target_pdf_path
+        if _convert_via_unoserver(None, target_pdf_path, data=docx_bytes):
+            return target_pdf_path
     except Exception:
         pass
 
-    # 2) Fallback: Word via docx2pdf (Windows only)
+    base_name = os.path.splitext(os.path.basename(target_pdf_path))[0]
+    docx_path = os.path.join(DOCX_DIR, f"{base_name}.docx")
+    # "wb" truncates any leftover file; no separate unlink needed
+    with open(docx_path, "wb") as f:
+        f.write(docx_bytes)
+    try:
+        return convert_to_pdf(docx_path, target_pdf_path)
+    finally:
+        # Always delete temporary DOCX (do not persist word files)
+        _remove_quietly(docx_path)
+
+
+def _convert_via_word(docx_path: str, target_pdf_path: str) -> Optional[str]:
+    """Convert with MS Word through docx2pdf. Windows only: on other platforms docx2pdf just
+    shells out to LibreOffice, which convert_to_pdf already drives directly, so it is not imported there.
+    """
+    if sys.platform != "win32":
+        return None
     try:
+        from docx2pdf import convert as docx2pdf_convert
         src = os.path.abspath(docx_path)
         dst = os.path.abspath(target_pdf_path)
-        # Try file-to-file
-        docx2pdf_convert(src, dst)
-        if os.path.exists(dst):
-            return dst
-        # Try file-to-directory (docx2pdf will name the PDF same as DOCX base)
-        outdir = os.path.dirname(dst)
-        os.makedirs(outdir, exist_ok=True)
-        docx2pdf_convert(src, outdir)
-        produced = os.path.join(outdir, os.path.splitext(os.path.basename(src))[0] + ".pdf")
-        if os.path.exists(produced):
-            # Move/rename to target path if needed
-            if os.path.abspath(produced) != os.path.abspath(dst):
-                try:
-                    if os.path.exists(dst):
-                        os.remove(dst)
-                except Exception:
-                    pass
+        with _pdf_staging_dir(dst) as tmp:
+            # Try file-to-file
+            produced = os.path.join(tmp, os.path.basename(dst))
+            docx2pdf_convert(src, produced)
+            if not os.path.exists(produced):
+                # Try file-to-directory (docx2pdf will name the PDF same as DOCX base)
+                docx2pdf_convert(src, tmp)
+                produced = os.path.join(tmp, os.path.splitext(os.path.basename(src))[0] + ".pdf")
+            if os.path.exists(produced):
                 os.replace(produced, dst)
-            return dst
+                return dst
     except Exception:
         pass
     return None
 
 
+def _soffice_convert_batch(soffice: str, pairs: List[Tuple[str, str]]) -> Dict[int, str]:
+    """Run one soffice process for a batch whose targets share a directory and whose DOCX
+    basenames are unique. soffice writes into a scratch folder and each PDF it produced is
+    os.replace()d onto its target. Returns {index in pairs: target path} for those PDFs."""
+    done: Dict[int, str] = {}
+    with _pdf_staging_dir(pairs[0][1]) as outdir:
+        slots = _soffice_slots()
+        slot = slots.get()
+        try:
+            profile = os.path.join(tempfile.gettempdir(), f"mierae-soffice-profile-{slot}")
+            cmd = [
+                soffice, f"-env:UserInstallation={Path(profile).as_uri()}",
+                "--headless", "--convert-to", "pdf", "--outdir", outdir, *(d for d, _ in pairs),
+            ]
+            subprocess.run(
+                cmd, stdin=subprocess.DEVNULL, timeout=60 + 15 * (len(pairs) - 1), **_QUIET_CHILD,
+            )
+        except Exception:
+            pass
+        finally:
+            slots.put(slot)
+        for i, (docx_path, target_pdf_path) in enumerate(pairs):
+            # The folder is fresh, so anything in it was written by this run
+            produced = os.path.join(outdir, os.path.splitext(os.path.basename(docx_path))[0] + ".pdf")
+            try:
+                os.replace(produced, target_pdf_path)
+                done[i] = target_pdf_path
+            except OSError:
+                pass
+    return done
+
+
+def convert_many_to_pdf(pairs: List[Tuple[str, str]]) -> List[Optional[str]]:
+    """Convert (docx_path, target_pdf_path) pairs; returns the PDF path (or None) for each pair.
+    Order of attempts per file: running unoserver listener, one-shot LibreOffice, Word (Windows).
+    Without the listener, LibreOffice converts every file sharing a target directory in a
+    single soffice invocation, so startup is paid once per batch instead of once per file.
+    """
+    results: List[Optional[str]] = [None] * len(pairs)
+    pending: List[int] = []
+    for i, (docx_path, target_pdf_path) in enumerate(pairs):
+        if not os.path.exists(docx_path):
+            continue
+        # Ensure target directory exists
+        try:
+            os.makedirs(os.path.dirname(target_pdf_path), exist_ok=True)
+        except Exception:
+            pass
+        pending.append(i)
+
+    # 1) Persistent LibreOffice listener via unoserver (no soffice startup per document),
+    # spread over every worker so a batch converts LIBREOFFICE_WORKERS files at a time
+    pool = _get_unoserver_pool() if pending else None
+    if pool is not None:
+        def _one(i: int) -> bool:
+            try:
+                return _convert_via_unoserver(pairs[i][0], pairs[i][1], pool=pool)
+            except Exception:
+                return False
+
+        if len(pending) > 1:
+            with ThreadPoolExecutor(max_workers=min(LIBREOFFICE_WORKERS, len(pending)), thread_name_prefix="uno") as ex:
+                ok = list(ex.map(_one, pending))
+        else:
+            ok = [_one(i) for i in pending]
+        for i, converted in zip(pending, ok):
+            if converted:
+                results[i] = pairs[i][1]
+        pending = [i for i in pending if results[i] is None]
+
+    # 2) One-shot LibreOffice (headless) if available (works on Linux/Streamlit Cloud and Windows if installed)
+    soffice = _find_soffice() if pending else None
+    if soffice:
+        # Group by target directory; a repeated DOCX basename would collide in --outdir, so it goes to a later batch
+        batches: List[List[int]] = []
+        for i in pending:
+            outdir = os.path.abspath(os.path.dirname(pairs[i][1]))
+            base = os.path.basename(pairs[i][0]).lower()
+            for batch in batches:
+                if (os.path.abspath(os.path.dirname(pairs[batch[0]][1])) == outdir
+                        and all(os.path.basename(pairs[k][0]).lower() != base for k in batch)):
+                    batch.append(i)
+                    break
+            else:
+                batches.append([i])
+        for batch in batches:
+            done = _soffice_convert_batch(soffice, [pairs[i] for i in batch])
+            for pos, target in done.items():
+                results[batch[pos]] = target
+        pending = [i for i in pending if results[i] is None]
+
+    # 3) Fallback: Word via docx2pdf (Windows only)
+    for i in pending:
+        results[i] = _convert_via_word(pairs[i][0], pairs[i][1])
+    return results
+
+
+def convert_to_pdf(docx_path: str, target_pdf_path: str) -> Optional[str]:
+    return convert_many_to_pdf([(docx_path, target_pdf_path)])[0]
+
+
+# Kept as one constant string so sqlite3's per-connection statement cache compiles it once
+INVOICE_INSERT_SQL = """
+    INSERT INTO invoices (
+        quotation_no, product, customer_name, mobile, location, city, state, pincode,
+        staff_name, date_of_quotation, validity_date,
+        application_reference, electricity_connection_no,
+        docx_path, pdf_path, created_at, updated_at, content_hash
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+
+def _invoice_row(record: Dict[str, str], now: str) -> Tuple:
+    return (
+        record.get("quotation_no"),
+        record.get("product"),
+        record.get("customer_name"),
+        record.get("mobile"),
+        record.get("location"),
+        record.get("city"),
+        record.get("state"),
+        record.get("pincode"),
+        record.get("staff_name"),
+        record.get("date_of_quotation"),
+        record.get("validity_date"),
+        record.get("application_reference"),
+        record.get("electricity_connection_no"),
+        record.get("docx_path"),
+        record.get("pdf_path"),
+        now,
+        now,
+        record.get("content_hash"),
+    )
+
+
 def save_to_db(conn: sqlite3.Connection, record: Dict[str, str]) -> None:
     """Save a record to the database."""
     now = datetime.now().isoformat(timespec="seconds")
-    conn.execute(
-        """
-        INSERT INTO invoices (
-            quotation_no, product, customer_name, mobile, location, city, state, pincode,
-            staff_name, date_of_quotation, validity_date,
-            application_reference, electricity_connection_no,
-            docx_path, pdf_path, created_at, updated_at
-        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """,
-        (
-            record.get("quotation_no"),
-            record.get("product"),
-            record.get("customer_name"),
-            record.get("mobile"),
-            record.get("location"),
-            record.get("city"),
-            record.get("state"),
-            record.get("pincode"),
-            record.get("staff_name"),
-            record.get("date_of_quotation"),
-            record.get("validity_date"),
-            record.get("application_reference"),
-            record.get("electricity_connection_no"),
-            record.get("docx_path"),
-            record.get("pdf_path"),
-            now,
-            now,
-        ),
+    conn.execute(INVOICE_INSERT_SQL, _invoice_row(record, now))
+    _invoices_changed()
+
+
+def _like_pattern(text: str) -> str:
+    """Substring LIKE pattern with %, _ and the escape char taken literally."""
+    esc = text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{esc}%"
+
+
+@st.cache_data(show_spinner=False, max_entries=32)
+def _search_invoices_cached(
+    gen: int,
+    name: Optional[str],
+    mobile: Optional[str],
+    product: Optional[str],
+    date_from: Optional[str],
+    date_to: Optional[str],
+) -> List[Dict[str, object]]:
+    where, params = [], []
+    if name:
+        where.append("customer_name LIKE ? ESCAPE '\\'")
+        params.append(_like_pattern(name))
+    if mobile:
+        where.append("mobile LIKE ? ESCAPE '\\'")
+        params.append(_like_pattern(mobile))
+    if product:
+        where.append("product = ?")
+        params.append(product)
+    if date_from:
+        where.append("date_of_quotation >= ?")
+        params.append(date_from)
+    if date_to:
+        where.append("date_of_quotation <= ?")
+        params.append(date_to)
+    sql = (
+        # Only the columns the results list renders; full records are fetched per row on demand
+        "SELECT id, customer_name, product, date_of_quotation, quotation_no, pdf_path FROM invoices"
+        + (" WHERE " + " AND ".join(where) if where else "")
+        + " ORDER BY id DESC"
     )
-    conn.commit()
-
-
-def load_invoices() -> pd.DataFrame:
-    """Load invoices from the database."""
-    conn = get_conn()
-    try:
-        df = pd.read_sql_query(
-            "SELECT id, customer_name, mobile, product, date_of_quotation, quotation_no, docx_path, pdf_path FROM invoices ORDER BY id DESC",
-            conn,
-        )
-    finally:
-        conn.close()
-    return df
+    with get_reader() as conn:
+        cur = conn.cursor()
+        cur.row_factory = sqlite3.Row
+        rows = cur.execute(sql, params).fetchall()
+    # Plain row dicts: the results list only iterates them, so no DataFrame is needed
+    return [dict(r) for r in rows]
+
+
+def search_invoices(
+    name: Optional[str] = None,
+    mobile: Optional[str] = None,
+    product: Optional[str] = None,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+) -> List[Dict[str, object]]:
+    """Filter invoices in SQL (name/mobile substring, exact product, ISO date range); row dicts, newest first."""
+    return _search_invoices_cached(_invoices_gen(), name, mobile, product, date_from, date_to)
+
+
+def has_invoices() -> bool:
+    with get_reader() as conn:
+        return conn.execute("SELECT EXISTS(SELECT 1 FROM invoices)").fetchone()[0] == 1
+
+
+def delete_invoices(ids: List[int]) -> int:
+    """Delete several invoices in one statement/transaction and remove their files.
+    Returns the number of rows deleted."""
+    ids = [int(i) for i in ids]
+    if not ids:
+        return 0
+    with get_writer() as conn:
+        # One statement deletes the rows and hands back their file paths
+        rows = conn.execute(
+            f"DELETE FROM invoices WHERE id IN ({','.join('?' * len(ids))}) RETURNING docx_path, pdf_path",
+            ids,
+        ).fetchall()
+        _invoices_changed()
+    for docx_path, pdf_path in rows:
+        _remove_quietly(docx_path)
+        _unpublish_pdf(pdf_path)
+        _remove_quietly(pdf_path)
+    return len(rows)
 
 
 def delete_invoice(inv_id: int) -> None:
     """Delete an invoice from the database."""
-    conn = get_conn()
-    try:
-        cur = conn.cursor()
-        cur.execute("SELECT docx_path, pdf_path FROM invoices WHERE id = ?", (inv_id,))
-        row = cur.fetchone()
-        if row:
-            docx_path, pdf_path = row
-            try:
-                if docx_path and os.path.exists(docx_path):
-                    os.remove(docx_path)
-            except Exception:
-                pass
-            try:
-                if pdf_path and os.path.exists(pdf_path):
-                    os.remove(pdf_path)
-            except Exception:
-                pass
-        conn.execute("DELETE FROM invoices WHERE id = ?", (inv_id,))
-        conn.commit()
-    finally:
-        conn.close()
+    delete_invoices([inv_id])
+
+
+def export_invoices_zip(ids: List[int]) -> Tuple[bytes, List[str]]:
+    """ZIP of the PDFs for the given invoices, plus the quotation numbers that could not be included.
+    Missing PDFs are rendered from the stored fields into a scratch folder with one batched
+    convert_many_to_pdf call; the export never writes to the records or the PDF folder.
+    PDFs are already compressed, so entries are stored rather than deflated."""
+    ids = [int(i) for i in ids]
+    if not ids:
+        return b"", []
+    with get_reader() as conn:
+        rows = conn.execute(
+            f"SELECT id, quotation_no, pdf_path FROM invoices WHERE id IN ({','.join('?' * len(ids))}) ORDER BY id",
+            ids,
+        ).fetchall()
+    paths = {rid: pdf for rid, _, pdf in rows}
+    missing = [rid for rid, _, pdf in rows if not (pdf and os.path.exists(pdf))]
+
+    skipped: List[str] = []
+    buf = io.BytesIO()
+    with tempfile.TemporaryDirectory(prefix="mierae-export-") as tmp:
+        if missing:
+            pairs: List[Tuple[str, str]] = []
+            rids: List[int] = []
+            for rid, rec in fetch_records_bulk(missing).items():
+                base = safe_filename(rec.get("quotation_no") or "") or f"invoice-{rid}"
+                docx_path = os.path.join(tmp, f"{base}.docx")
+                try:
+                    with open(docx_path, "wb") as f:
+                        f.write(_invoice_docx(rec, _template_for_product(rec.get("product", ""))).getbuffer())
+                except Exception:
+                    continue
+                pairs.append((docx_path, os.path.join(tmp, "pdf", f"{base}.pdf")))
+                rids.append(rid)
+            # One soffice start for the whole set when the unoserver listener is not running
+            for rid, pdf in zip(rids, convert_many_to_pdf(pairs)):
+                paths[rid] = pdf
+
+        with zipfile.ZipFile(buf, "w", zipfile.ZIP_STORED) as zf:
+            for rid, qno, _ in rows:
+                pdf = paths.get(rid)
+                if pdf and os.path.exists(pdf):
+                    zf.write(pdf, arcname=os.path.basename(pdf))
+                else:
+                    skipped.append(qno)
+    return buf.getvalue(), skipped
 
 
 def edit_agreement(agr_id: int, tags: Dict[str, str]) -> Optional[str]:
@@ -1260,11 +2263,6 @@ def edit_agreement(agr_id: int, tags: Dict[str, str]) -> Optional[str]:
         raise FileNotFoundError("templates/agreement template.docx not found")
 
     temp_docx = os.path.join(DOCX_DIR, f"{base}.docx")
-    try:
-        if os.path.exists(temp_docx):
-            os.remove(temp_docx)
-    except Exception:
-        pass
 
     # Populate using XML-level tag replacement
     _docx_zip_replace_tags(template_path, temp_docx, {
@@ -1304,21 +2302,15 @@ def edit_agreement(agr_id: int, tags: Dict[str, str]) -> Optional[str]:
         pass
 
     target_pdf = os.path.join(AGREEMENT_PDF_DIR, f"{base}.pdf")
-    try:
-        if os.path.exists(target_pdf):
-            os.remove(target_pdf)
-    except Exception:
-        pass
     pdf_path = _convert_to_pdf_word_first(temp_docx, target_pdf)
     if pdf_path:
-        try:
-            if os.path.exists(temp_docx):
-                os.remove(temp_docx)
-        except Exception:
-            pass
+        _unpublish_pdf(target_pdf)
+        _remove_quietly(temp_docx)
+    # A failed conversion leaves the previous PDF in place; keep pointing at it
+    old_pdf = rec.get("agreement_pdf_path")
+    stored_pdf = pdf_path or (old_pdf if old_pdf and os.path.exists(old_pdf) else None)
 
-    conn = get_conn()
-    try:
+    with get_writer() as conn:
         conn.execute(
             """
             UPDATE agreements
@@ -1330,13 +2322,37 @@ def edit_agreement(agr_id: int, tags: Dict[str, str]) -> Optional[str]:
                 tags.get("Number", rec.get("number", "")),
                 tags.get("Address", rec.get("address", "")),
                 tags.get("Date", rec.get("date", "")),
-                pdf_path,
+                stored_pdf,
                 agr_id,
             ),
         )
-        conn.commit()
-    finally:
-        conn.close()
+    return pdf_path
+
+
+def _regenerate_invoice_pdf(
+    form_data: Dict[str, str], template_path: str, old_docx_path: Optional[str], old_pdf_path: Optional[str]
+) -> Optional[str]:
+    """Render the edited invoice to PDF and clean up files from the previous version."""
+    docx_bytes = _invoice_docx(form_data, template_path)
+
+    # Use only Quotation No for file naming so one quotation -> one PDF file
+    safe_qno = safe_filename(form_data["quotation_no"]) if form_data.get("quotation_no") else "qno"
+    base_name = f"{safe_qno}"
+    pdf_path = convert_docx_bytes_to_pdf(docx_bytes.getbuffer(), os.path.join(PDF_DIR, f"{base_name}.pdf"))
+
+    # Remove any previously stored DOCX (word files are no longer persisted)
+    _remove_quietly(old_docx_path)
+
+    # On failure the previous PDF is still in place (and stays published); edit_invoice keeps it
+    if pdf_path:
+        # Published copies are of the previous version
+        target_pdf_path = os.path.join(PDF_DIR, f"{base_name}.pdf")
+        _unpublish_pdf(target_pdf_path)
+        # If previous PDF exists and path differs from new target, delete it
+        if old_pdf_path and os.path.abspath(old_pdf_path) != os.path.abspath(target_pdf_path):
+            _unpublish_pdf(old_pdf_path)
+            _remove_quietly(old_pdf_path)
+
     return pdf_path
 
 
@@ -1345,69 +2361,39 @@ def edit_invoice(inv_id: int, form_data: Dict[str, str], template_path: str) ->
     We no longer persist DOCX files; use temporary DOCX for conversion only.
     """
     ensure_dirs()
-    conn = get_conn()
-    try:
-        # Fetch existing quotation_no and existing file paths to keep it stable and replace old PDF
+    # Fetch existing quotation_no and existing file paths to keep it stable and replace old PDF
+    with get_reader() as conn:
         cur = conn.cursor()
-        cur.execute("SELECT quotation_no, docx_path, pdf_path FROM invoices WHERE id = ?", (inv_id,))
+        cur.execute("SELECT quotation_no, docx_path, pdf_path, content_hash FROM invoices WHERE id = ?", (inv_id,))
         row = cur.fetchone()
-        if not row:
-            raise ValueError("Invoice not found")
-        quotation_no, old_docx_path, old_pdf_path = row[0], row[1], row[2]
-        form_data = dict(form_data)
-        form_data["quotation_no"] = quotation_no
-
-        values = [
-            form_data.get("customer_name", ""),
-            form_data.get("location", ""),
-            form_data.get("city", ""),
-            form_data.get("state", ""),
-            form_data.get("pincode", ""),
-            form_data.get("mobile", ""),
-            form_data.get("product", ""),
-            form_data.get("quotation_no", ""),
-            form_data.get("date_of_quotation", ""),
-            form_data.get("validity_date", ""),
-        ]
-        docx_bytes = generate_docx(values, form_data, template_path)
-
-        # Use only Quotation No for file naming so one quotation -> one PDF file
-        safe_qno = safe_filename(form_data["quotation_no"]) if form_data.get("quotation_no") else "qno"
-        base_name = f"{safe_qno}"
-        temp_docx_path = os.path.join(DOCX_DIR, f"{base_name}.docx")
-        with open(temp_docx_path, "wb") as f:
-            f.write(docx_bytes.getvalue())
-
-        pdf_path = convert_to_pdf(temp_docx_path, os.path.join(PDF_DIR, f"{base_name}.pdf"))
-
-        # Always delete temporary DOCX and remove any previously stored DOCX
-        try:
-            if os.path.exists(temp_docx_path):
-                os.remove(temp_docx_path)
-        except Exception:
-            pass
-        try:
-            if old_docx_path and os.path.exists(old_docx_path):
-                os.remove(old_docx_path)
-        except Exception:
-            pass
-
-        # If previous PDF exists and path differs from new target, delete it
-        target_pdf_path = os.path.join(PDF_DIR, f"{base_name}.pdf")
-        try:
-            if old_pdf_path and os.path.exists(old_pdf_path) and os.path.abspath(old_pdf_path) != os.path.abspath(target_pdf_path):
-                os.remove(old_pdf_path)
-        except Exception:
-            pass
+    if not row:
+        raise ValueError("Invoice not found")
+    quotation_no, old_docx_path, old_pdf_path, old_hash = row[0], row[1], row[2], row[3]
+    form_data = dict(form_data)
+    form_data["quotation_no"] = quotation_no
+    new_hash = _content_hash(form_data, template_path)
+
+    # Nothing the template renders changed (e.g. staff-only edit): keep the existing PDF
+    if old_hash and old_hash == new_hash and old_pdf_path and os.path.exists(old_pdf_path):
+        pdf_path = old_pdf_path
+    else:
+        pdf_path = _regenerate_invoice_pdf(form_data, template_path, old_docx_path, old_pdf_path)
+    stored_pdf = pdf_path
+    if not pdf_path:
+        # Keep serving the last good PDF; the cleared hash makes the next edit or export regenerate it
+        new_hash = None
+        if old_pdf_path and os.path.exists(old_pdf_path):
+            stored_pdf = old_pdf_path
 
-        now = datetime.now().isoformat(timespec="seconds")
+    now = datetime.now().isoformat(timespec="seconds")
+    with get_writer() as conn:
         conn.execute(
             """
             UPDATE invoices
             SET product=?, customer_name=?, mobile=?, location=?, city=?, state=?, pincode=?, staff_name=?,
                 date_of_quotation=?, validity_date=?,
                 application_reference=?, electricity_connection_no=?,
-                docx_path=?, pdf_path=?, updated_at=?
+                docx_path=?, pdf_path=?, updated_at=?, content_hash=?
             WHERE id=?
             """,
             (
@@ -1424,15 +2410,14 @@ def edit_invoice(inv_id: int, form_data: Dict[str, str], template_path: str) ->
                 form_data.get("application_reference"),
                 form_data.get("electricity_connection_no"),
                 None,
-                pdf_path,
+                stored_pdf,
                 now,
+                new_hash,
                 inv_id,
             ),
         )
-        conn.commit()
-        return None, pdf_path
-    finally:
-        conn.close()
+        _invoices_changed()
+    return None, pdf_path
 
 
 # ---------------------------
@@ -1442,13 +2427,37 @@ def edit_invoice(inv_id: int, form_data: Dict[str, str], template_path: str) ->
 AGREEMENT_PREFIX = "AGR"
 
 def _next_agreement_no(conn: sqlite3.Connection) -> str:
-    """Generate next agreement number like AGR-YYYYMM-XXXX."""
-    now = datetime.now()
-    ym = now.strftime("%Y%m")
-    cur = conn.cursor()
-    cur.execute("SELECT COUNT(*) FROM agreements WHERE agreement_no LIKE ?", (f"{AGREEMENT_PREFIX}-{ym}-%",))
-    n = cur.fetchone()[0] or 0
-    return f"{AGREEMENT_PREFIX}-{ym}-{n+1:04d}"
+    """Reserve the next agreement number like AGR-YYYYMM-XXXX on the writer connection.
+    Each month has its own row in `counters` ('agr-YYYYMM'), so this is a primary-key UPDATE ... RETURNING.
+    A month's row is seeded from the highest existing number the first time it is used; the GLOB
+    prefix match is a range scan on agreement_no's unique index.
+    """
+    ym = datetime.now().strftime("%Y%m")
+    prefix = f"{AGREEMENT_PREFIX}-{ym}-"
+    key = f"agr-{ym}"
+    row = conn.execute("UPDATE counters SET v = v + 1 WHERE name = ? RETURNING v", (key,)).fetchone()
+    if row is None:
+        row = conn.execute(
+            """
+            INSERT INTO counters (name, v)
+            SELECT ?, COALESCE(MAX(CAST(substr(agreement_no, ?) AS INTEGER)), 0) + 1
+            FROM agreements WHERE agreement_no GLOB ?
+            RETURNING v
+            """,
+            (key, len(prefix) + 1, f"{prefix}*"),
+        ).fetchone()
+    return f"{prefix}{int(row[0]):04d}"
+
+
+def _release_agreement_no(conn: sqlite3.Connection, agreement_no: str) -> None:
+    """Give back a reserved agreement number if nothing was issued after it (e.g. generation failed)."""
+    try:
+        prefix, n = agreement_no.rsplit("-", 1)
+        key = f"agr-{prefix[len(AGREEMENT_PREFIX) + 1:]}"
+        n = int(n)
+    except Exception:
+        return
+    conn.execute("UPDATE counters SET v = v - 1 WHERE name = ? AND v = ?", (key, n))
 
 
 def _save_feasibility_pdf(file_bytes: bytes, filename_hint: str) -> str:
@@ -1457,30 +2466,38 @@ def _save_feasibility_pdf(file_bytes: bytes, filename_hint: str) -> str:
     """
     ensure_dirs()
     path = os.path.join(FEASIBILITY_DIR, "feasibility.pdf")
-    try:
-        if os.path.exists(path):
-            os.remove(path)
-    except Exception:
-        pass
+    _remove_quietly(path)
     with open(path, "wb") as f:
         f.write(file_bytes)
     # Log the upload event in DB
-    conn = get_conn()
-    try:
+    with get_writer() as conn:
         conn.execute("INSERT INTO feasibility_events (uploaded_at) VALUES (?)", (datetime.now().isoformat(timespec="seconds"),))
-        conn.commit()
-    finally:
-        conn.close()
     return path
 
 
-def _read_pdf_text(pdf_bytes: bytes) -> str:
-    """Extract text, preferring pdfminer for higher fidelity, with PyPDF2 fallback."""
-    # 1) Try pdfminer.six (best for structured text in tables)
+def _read_pdf_text(pdf_bytes: bytes, enough: Optional[Callable[[str], bool]] = None) -> str:
+    """Extract text, preferring pdfminer for higher fidelity, with PyPDF2 fallback.
+    Pages are read one at a time; with `enough`, reading stops one page after the text so far
+    satisfies it (that page finishes any block split across the break), so later pages are never parsed.
+    """
+    # 1) Try pdfminer.six (best for structured text in tables); same pipeline as high_level.extract_text
     try:
-        from pdfminer.high_level import extract_text as _pdfminer_extract
-        bio1 = io.BytesIO(pdf_bytes)
-        txt = _pdfminer_extract(bio1) or ""
+        from pdfminer.converter import TextConverter
+        from pdfminer.layout import LAParams
+        from pdfminer.pdfinterp import PDFPageInterpreter, PDFResourceManager
+        from pdfminer.pdfpage import PDFPage
+        out = io.StringIO()
+        rsrcmgr = PDFResourceManager(caching=True)
+        # The device closes on exit, also when a page fails to parse
+        with TextConverter(rsrcmgr, out, codec="utf-8", laparams=LAParams()) as device:
+            interpreter = PDFPageInterpreter(rsrcmgr, device)
+            satisfied = False
+            for page in PDFPage.get_pages(io.BytesIO(pdf_bytes), caching=True):
+                interpreter.process_page(page)
+                if satisfied:
+                    break
+                satisfied = enough is not None and enough(out.getvalue())
+        txt = out.getvalue()
         if txt and txt.strip():
             return txt
     except Exception:
@@ -1491,22 +2508,121 @@ def _read_pdf_text(pdf_bytes: bytes) -> str:
         bio2 = io.BytesIO(pdf_bytes)
         reader = PdfReader(bio2)
         texts = []
+        satisfied = False
         for page in reader.pages:
             try:
                 texts.append(page.extract_text() or "")
             except Exception:
                 pass
+            if satisfied:
+                break
+            satisfied = enough is not None and enough("\n".join(texts))
         return "\n".join(texts)
     except Exception:
         return ""
 
 
+def _feasibility_fields_found(text: str) -> bool:
+    """Stop condition for _read_pdf_text: Date, Name of Applicant and Mobile No each have an inline
+    "Label: value" match on their first label, and the address block is complete.
+    Those are the earliest matches in the document, so no later page can displace them; a field found
+    only by a fallback scan keeps the reader going, since a later page may hold its labelled value.
+    """
+    t = (text or "").replace("\r", "\n").replace("\u00A0", " ")
+    values = []
+    for labels in (_RE_DATE_LABELS, _RE_NAME_LABELS, _RE_MOBILE_LABELS):
+        m = labels[0][0].search(t)
+        if not m:
+            return False
+        values.append(_RE_NEXT_LABEL.split(m.group(1).strip(), maxsplit=1)[0].strip())
+    if not values[0] or not values[2] or not _is_valid_name(values[1]):
+        return False
+    # The address block (up to 9 lines after its header) must already be closed, not run on into the next page
+    lines = [ln.strip() for ln in t.splitlines() if ln.strip()]
+    addr_idx = next((i for i, ln in enumerate(lines) if _RE_ADDR_HEADER.search(ln)), None)
+    if addr_idx is None:
+        return False
+    block = lines[addr_idx + 1:addr_idx + 10]
+    if len(block) < 9 and not any(_RE_ADDR_END.match(ln) for ln in block):
+        return False
+    # Cheap checks passed: confirm once with the full extraction (the address block must yield a value)
+    return all(_extract_fields_from_text(text).values())
+
+
+def _label_res(*labels: str) -> Tuple[Tuple[re.Pattern, re.Pattern], ...]:
+    """(label: value on the same line, label alone on its line) pattern pairs for find_after."""
+    return tuple(
+        (re.compile(rf"{p}\s*[:\-]\s*(.+)", re.IGNORECASE), re.compile(rf"^{p}\s*[:\-]?\s*$", re.IGNORECASE))
+        for p in labels
+    )
+
+
+# Feasibility-form patterns used by _extract_fields_from_text, compiled once at import
+_RE_DATE_LABELS = _label_res(r"Date")
+_RE_NAME_LABELS = _label_res(r"Name\s+of\s+Applicant", r"Applicant\s*Name")
+_RE_MOBILE_LABELS = _label_res(r"Mobile\s*No", r"Mobile\s*Number", r"Contact\s*No")
+_RE_NEXT_LABEL = re.compile(
+    r"\s{2,}|\s*(?:Name of Applicant|Mobile\s*No|Address of Premises for Installation|Date)\s*[:\-]", re.IGNORECASE
+)
+_RE_ADDR_HEADER = re.compile(r"Address\s+of\s+Premises\s+for\s+installation", re.IGNORECASE)
+_RE_ADDR_END = re.compile(r"^\d+\.|^Feasibility\s+Approval\s+Details|^(From|To)\b", re.IGNORECASE)
+# One anchored alternation classifies an address line; the matching group names the part
+_RE_ADDR_FIELDS = re.compile(
+    r"^(?:(?P<district>District)|(?P<state>State)|(?P<pincode>PIN\s*Code|Pincode))\s*:\s*", re.IGNORECASE
+)
+_RE_SPACES = re.compile(r"\s+")
+_RE_COMMA_SPACING = re.compile(r"\s*,\s*")
+_RE_REPEATED_COMMAS = re.compile(r",\s*,+")
+_RE_MOBILE_ROW = re.compile(r"\b(?:mobile\s*(?:no\.?|number)|contact\s*no\.?|phone\s*no\.?)\b", re.IGNORECASE)
+_RE_DIGITS_8_13 = re.compile(r"\d{8,13}")
+_RE_SPACED_DIGITS = re.compile(r"(?:\d[\s\-]?){9,14}\d")
+_RE_NON_DIGIT = re.compile(r"\D")
+_RE_OTHER_LABEL_ROW = re.compile(
+    r":|email|consumer|category|address|application|reference|discom|particulars|details", re.IGNORECASE
+)
+_RE_DIGITS_10_13 = re.compile(r"\b\d{10,13}\b")
+_RE_DIGITS_10 = re.compile(r"\d{10}")
+_RE_DATE_GRANTED = re.compile(
+    r"granted\s+on\s+date\s*[:\-]?\s*([0-9]{1,2}[^0-9A-Za-z][0-9]{1,2}[^0-9A-Za-z][0-9]{2,4})", re.IGNORECASE
+)
+_RE_DATE_INLINE = re.compile(
+    r"date\s*[:\-]?\s*([0-9]{1,2}[^0-9A-Za-z][0-9]{1,2}[^0-9A-Za-z][0-9]{2,4})", re.IGNORECASE
+)
+_RE_DATE_PARTS = re.compile(r"(\d{1,2})[^0-9A-Za-z](\d{1,2})[^0-9A-Za-z](\d{2,4})")
+_RE_LETTER = re.compile(r"[A-Za-z]")
+_RE_DIGIT = re.compile(r"\d")
+_RE_NAME_LABEL = re.compile(r"\bname\s*of\s*applicant\b", re.IGNORECASE)
+_RE_NAME_INLINE = re.compile(r"\bname\s*of\s*applicant\b\s*(?:[:\-]|\s{2,}|\t)\s*(.+)$", re.IGNORECASE)
+_RE_COLUMN_SPLIT = re.compile(r"\s{2,}|\t")
+_RE_HONORIFIC_NAME = re.compile(r"(Shri|Smt|Shri/Smt|Sh\.?/Smt\.?)\s*[:.-]?\s*([A-Z][A-Za-z .,-]+)", re.IGNORECASE)
+
+
+def _is_valid_name(s: Optional[str]) -> bool:
+    """Whether an applicant-name capture looks like a name rather than another label or a number."""
+    if not s:
+        return False
+    t = s.strip()
+    if not t:
+        return False
+    low = t.lower()
+    # disqualify obvious labels
+    forbidden = [
+        'mobile', 'phone', 'email', 'email id', 'consumer', 'category', 'address',
+        'application', 'reference', 'number', 'no.', 'capacity', 'kwp', 'kw', 'discom',
+    ]
+    if any(k in low for k in forbidden):
+        return False
+    # must contain letters and not be mostly digits
+    letters = len(_RE_LETTER.findall(t))
+    digits = len(_RE_DIGIT.findall(t))
+    return letters >= 2 and letters > digits
+
+
 def _extract_fields_from_text(text: str) -> Dict[str, str]:
     """Extract Date, Name of Applicant, Mobile No, Address of Premises for Installation.
     Return keys: Date, Name, Address, Number.
     """
-    t = re.sub(r"\r", "\n", text or "")
-    t = re.sub(r"\u00A0", " ", t)
+    t = (text or "").replace("\r", "\n").replace("\u00A0", " ")
     lines = [ln.strip() for ln in t.splitlines() if ln.strip()]
     joined = "\n".join(lines)
 
@@ -1523,28 +2639,28 @@ def _extract_fields_from_text(text: str) -> Dict[str, str]:
             return " ".join(toks[1:]).strip()
         return None
 
-    def find_after(label_patterns: List[str]) -> Optional[str]:
-        for pat in label_patterns:
-            m = re.search(rf"{pat}\s*[:\-]\s*(.+)", joined, flags=re.IGNORECASE)
+    def find_after(label_res: Tuple[Tuple[re.Pattern, re.Pattern], ...]) -> Optional[str]:
+        for inline_re, _ in label_res:
+            m = inline_re.search(joined)
             if m:
                 val = m.group(1).strip()
-                val = re.split(r"\s{2,}|\s*(?:Name of Applicant|Mobile\s*No|Address of Premises for Installation|Date)\s*[:\-]", val, maxsplit=1, flags=re.IGNORECASE)[0].strip()
+                val = _RE_NEXT_LABEL.split(val, maxsplit=1)[0].strip()
                 return val
         for idx, ln in enumerate(lines):
-            for pat in label_patterns:
-                if re.search(rf"^{pat}\s*[:\-]?\s*$", ln, flags=re.IGNORECASE):
+            for _, bare_re in label_res:
+                if bare_re.search(ln):
                     if idx + 1 < len(lines):
                         return lines[idx + 1].strip()
         return None
 
     # Primary label-based capture
-    date_val = find_after([r"Date"]) or None
-    name_val = find_after([r"Name\s+of\s+Applicant", r"Applicant\s*Name"]) or None
-    mobile_val = find_after([r"Mobile\s*No", r"Mobile\s*Number", r"Contact\s*No"]) or None
+    date_val = find_after(_RE_DATE_LABELS) or None
+    name_val = find_after(_RE_NAME_LABELS) or None
+    mobile_val = find_after(_RE_MOBILE_LABELS) or None
     # Address block: capture block after "Address of Premises for installation" up to next numbered section or blank
     addr_idx = None
     for i, ln in enumerate(lines):
-        if re.search(r"Address\s+of\s+Premises\s+for\s+installation", ln, flags=re.IGNORECASE):
+        if _RE_ADDR_HEADER.search(ln):
             addr_idx = i
             break
     address_val = None
@@ -1552,51 +2668,46 @@ def _extract_fields_from_text(text: str) -> Dict[str, str]:
         block = []
         for j in range(addr_idx + 1, min(addr_idx + 10, len(lines))):
             l = lines[j]
-            if re.match(r"^\d+\.|^Feasibility\s+Approval\s+Details", l, flags=re.IGNORECASE):
-                break
-            if re.match(r"^(From|To)\b", l, flags=re.IGNORECASE):
+            if _RE_ADDR_END.match(l):
                 break
             block.append(l)
         # Extract parts
         base_addr = None
-        district = None
-        state = None
-        pincode = None
+        fields: Dict[str, str] = {}
         for b in block:
-            if re.search(r"^District\s*:\s*", b, flags=re.IGNORECASE):
-                district = re.sub(r"^District\s*:\s*", "", b, flags=re.IGNORECASE).strip().strip(',')
-            elif re.search(r"^State\s*:\s*", b, flags=re.IGNORECASE):
-                state = re.sub(r"^State\s*:\s*", "", b, flags=re.IGNORECASE).strip().strip(',')
-            elif re.search(r"^(PIN\s*Code|Pincode)\s*:\s*", b, flags=re.IGNORECASE):
-                pincode = re.sub(r"^(PIN\s*Code|Pincode)\s*:\s*", "", b, flags=re.IGNORECASE).strip().strip(',')
+            m = _RE_ADDR_FIELDS.match(b)
+            if m:
+                fields[m.lastgroup] = b[m.end():].strip().strip(',')
             elif not base_addr:
                 base_addr = b.strip().strip(',')
+        district = fields.get("district")
+        state = fields.get("state")
+        pincode = fields.get("pincode")
         if base_addr or district or state or pincode:
             # Compose without labels, e.g., "12/21B, Ashoke Nagar Road, Barasat, West Bengal, 112233"
             parts = [x for x in [base_addr, district, state, pincode] if x]
             addr = ", ".join(parts)
             # Normalize spacing: collapse multiple spaces; trim spaces around commas
-            addr = re.sub(r"\s+", " ", addr)
-            addr = re.sub(r"\s*,\s*", ", ", addr)
-            addr = re.sub(r",\s*,+", ", ", addr)
+            addr = _RE_SPACES.sub(" ", addr)
+            addr = _RE_COMMA_SPACING.sub(", ", addr)
+            addr = _RE_REPEATED_COMMAS.sub(", ", addr)
             address_val = addr.strip()
 
     # Fallbacks if primary capture failed
     joined_lower = joined.lower()
     if not mobile_val:
         # Row-based scan for Mobile No – strictly target the same row then immediate next few lines
-        mob_row_pattern = re.compile(r"\b(?:mobile\s*(?:no\.?|number)|contact\s*no\.?|phone\s*no\.?)\b", re.IGNORECASE)
         for i, ln in enumerate(lines):
-            if mob_row_pattern.search(ln):
+            if _RE_MOBILE_ROW.search(ln):
                 # 1) Try to take digits from the same line after the label
-                tail = mob_row_pattern.split(ln, maxsplit=1)[-1]
+                tail = _RE_MOBILE_ROW.split(ln, maxsplit=1)[-1]
                 # remove separators then extract digits
-                d_same = re.findall(r"\d{8,13}", tail)
+                d_same = _RE_DIGITS_8_13.findall(tail)
                 if not d_same:
                     # Also handle formats with spaces/dashes in the number
-                    d_same2 = re.findall(r"(?:\d[\s\-]?){9,14}\d", tail)
+                    d_same2 = _RE_SPACED_DIGITS.findall(tail)
                     if d_same2:
-                        d_join = re.sub(r"\D", "", d_same2[-1])
+                        d_join = _RE_NON_DIGIT.sub("", d_same2[-1])
                         if 8 <= len(d_join) <= 13:
                             d_same = [d_join]
                 if d_same:
@@ -1611,13 +2722,13 @@ def _extract_fields_from_text(text: str) -> Dict[str, str]:
                     if not cand:
                         continue
                     # skip if looks like another label row
-                    if re.search(r":|email|consumer|category|address|application|reference|discom|particulars|details", cand, flags=re.IGNORECASE):
+                    if _RE_OTHER_LABEL_ROW.search(cand):
                         continue
-                    d_next = re.findall(r"\d{8,13}", cand)
+                    d_next = _RE_DIGITS_8_13.findall(cand)
                     if not d_next:
-                        d_next2 = re.findall(r"(?:\d[\s\-]?){9,14}\d", cand)
+                        d_next2 = _RE_SPACED_DIGITS.findall(cand)
                         if d_next2:
-                            d_next = [re.sub(r"\D", "", d_next2[-1])]
+                            d_next = [_RE_NON_DIGIT.sub("", d_next2[-1])]
                     if d_next:
                         pick = [x for x in d_next if len(x) == 10]
                         mobile_val = (pick[-1] if pick else d_next[-1])
@@ -1627,54 +2738,35 @@ def _extract_fields_from_text(text: str) -> Dict[str, str]:
                     break
     # If still not found, pick best digit-only candidate of length 10-13
     if not mobile_val:
-        cands = re.findall(r"\b\d{10,13}\b", joined)
+        cands = _RE_DIGITS_10_13.findall(joined)
         if cands:
             # prefer 10-digit, else longest
             ten = [c for c in cands if len(c) == 10]
             mobile_val = ten[0] if ten else max(cands, key=len)
     if not date_val:
         # Header style: granted on date: dd-mm-yyyy
-        m = re.search(r"granted\s+on\s+date\s*[:\-]?\s*([0-9]{1,2}[^0-9A-Za-z][0-9]{1,2}[^0-9A-Za-z][0-9]{2,4})", joined_lower, flags=re.IGNORECASE)
+        m = _RE_DATE_GRANTED.search(joined_lower)
         if not m:
-            m = re.search(r"date\s*[:\-]?\s*([0-9]{1,2}[^0-9A-Za-z][0-9]{1,2}[^0-9A-Za-z][0-9]{2,4})", joined_lower, flags=re.IGNORECASE)
+            m = _RE_DATE_INLINE.search(joined_lower)
         if m:
             date_val = m.group(1)
-    def is_valid_name(s: Optional[str]) -> bool:
-        if not s:
-            return False
-        t = s.strip()
-        if not t:
-            return False
-        low = t.lower()
-        # disqualify obvious labels
-        forbidden = [
-            'mobile', 'phone', 'email', 'email id', 'consumer', 'category', 'address',
-            'application', 'reference', 'number', 'no.', 'capacity', 'kwp', 'kw', 'discom',
-        ]
-        if any(k in low for k in forbidden):
-            return False
-        # must contain letters and not be mostly digits
-        letters = len(re.findall(r"[A-Za-z]", t))
-        digits = len(re.findall(r"\d", t))
-        return letters >= 2 and letters > digits
-
-    if not is_valid_name(name_val):
+    if not _is_valid_name(name_val):
         # Row-based scan (handles tables) around the label row
         for i, ln in enumerate(lines):
-            if re.search(r"\bname\s*of\s*applicant\b", ln, flags=re.IGNORECASE):
+            if _RE_NAME_LABEL.search(ln):
                 # prefer taking the RIGHT column/value on the same line
                 # patterns: <label> : <value>  OR  <label> <many spaces or tab> <value>
-                m_same = re.search(r"\bname\s*of\s*applicant\b\s*(?:[:\-]|\s{2,}|\t)\s*(.+)$", ln, flags=re.IGNORECASE)
+                m_same = _RE_NAME_INLINE.search(ln)
                 v = None
                 if m_same:
                     v = m_same.group(1).strip()
                 else:
                     # As a fallback, split by two+ spaces and take last chunk to mimic table column split
-                    parts = re.split(r"\s{2,}|\t", ln)
+                    parts = _RE_COLUMN_SPLIT.split(ln)
                     # ensure left-most chunk contains the label; take last non-empty chunk as value
-                    if len(parts) >= 2 and re.search(r"\bname\s*of\s*applicant\b", parts[0], flags=re.IGNORECASE):
+                    if len(parts) >= 2 and _RE_NAME_LABEL.search(parts[0]):
                         v = parts[-1].strip()
-                if not is_valid_name(v):
+                if not _is_valid_name(v):
                     # try the very next non-empty line as the details cell
                     # but skip if it obviously looks like another label row (contains ':' or known keywords)
                     for j in range(i+1, min(i+5, len(lines))):
@@ -1686,39 +2778,39 @@ def _extract_fields_from_text(text: str) -> Dict[str, str]:
                             continue
                         if any(k in lowc for k in ['mobile', 'phone', 'email', 'consumer', 'category', 'address', 'application', 'reference']):
                             continue
-                        if is_valid_name(cand):
+                        if _is_valid_name(cand):
                             v = cand
                             break
-                if not is_valid_name(v):
+                if not _is_valid_name(v):
                     # search next few rows for a name-like candidate
                     for j in range(i+1, min(i+8, len(lines))):
                         cand = lines[j].strip()
-                        if is_valid_name(cand):
+                        if _is_valid_name(cand):
                             v = cand
                             break
                     # also look a couple of lines above in case of wrap
-                    if not is_valid_name(v):
+                    if not _is_valid_name(v):
                         for j in range(max(0, i-3), i):
                             cand = lines[j].strip()
-                            if is_valid_name(cand):
+                            if _is_valid_name(cand):
                                 v = cand
                                 break
-                if is_valid_name(v):
+                if _is_valid_name(v):
                     name_val = v
                     break
         # Header-style fallback like 'Shri/Smt <NAME> ...'
-        if not is_valid_name(name_val):
-            m = re.search(r"(Shri|Smt|Shri/Smt|Sh\.?/Smt\.?)\s*[:.-]?\s*([A-Z][A-Za-z .,-]+)", joined, flags=re.IGNORECASE)
-            if m and is_valid_name(m.group(1)):
+        if not _is_valid_name(name_val):
+            m = _RE_HONORIFIC_NAME.search(joined)
+            if m and _is_valid_name(m.group(1)):
                 name_val = (m.group(2) or m.group(1)).strip()
 
     if mobile_val:
         # Normalize: extract digits, prefer a clean 10-digit Indian-style number if present
-        digits = re.findall(r"\d", mobile_val)
+        digits = _RE_DIGIT.findall(mobile_val)
         if digits:
             s = "".join(digits)
             # If there is a 10-digit substring, take the last one
-            m10 = re.findall(r"\d{10}", s)
+            m10 = _RE_DIGITS_10.findall(s)
             if m10:
                 mobile_val = m10[-1]
             elif len(s) >= 10:
@@ -1735,7 +2827,7 @@ def _extract_fields_from_text(text: str) -> Dict[str, str]:
                 return d.strftime("%d-%m-%Y")
             except Exception:
                 continue
-        m = re.search(r"(\d{1,2})[^0-9A-Za-z](\d{1,2})[^0-9A-Za-z](\d{2,4})", s)
+        m = _RE_DATE_PARTS.search(s)
         if m:
             d, mth, y = m.groups()
             y = y if len(y) == 4 else ("20" + y)
@@ -1778,7 +2870,7 @@ def _replace_tags_in_docx(doc: DocxDocument, mapping: Dict[str, str]) -> None:
             while j < len(runs):
                 r = runs[j]
                 try:
-                    if r.font.highlight_color == WD_COLOR_INDEX.YELLOW:
+                    if _is_yellow(r):
                         seq.append(r)
                         j += 1
                         continue
@@ -1820,27 +2912,9 @@ def _replace_tags_in_docx(doc: DocxDocument, mapping: Dict[str, str]) -> None:
 def _convert_to_pdf_word_first(docx_path: str, target_pdf_path: str) -> Optional[str]:
     """Prefer MS Word via docx2pdf for best layout fidelity on Windows, then fallback to LibreOffice."""
     # Try Word/docx2pdf first
-    try:
-        src = os.path.abspath(docx_path)
-        dst = os.path.abspath(target_pdf_path)
-        docx2pdf_convert(src, dst)
-        if os.path.exists(dst):
-            return dst
-        outdir = os.path.dirname(dst)
-        os.makedirs(outdir, exist_ok=True)
-        docx2pdf_convert(src, outdir)
-        produced = os.path.join(outdir, os.path.splitext(os.path.basename(src))[0] + ".pdf")
-        if os.path.exists(produced):
-            if os.path.abspath(produced) != os.path.abspath(dst):
-                try:
-                    if os.path.exists(dst):
-                        os.remove(dst)
-                except Exception:
-                    pass
-                os.replace(produced, dst)
-            return dst
-    except Exception:
-        pass
+    pdf = _convert_via_word(docx_path, target_pdf_path)
+    if pdf:
+        return pdf
     # Fallback to existing pipeline (LibreOffice then Word)
     return convert_to_pdf(docx_path, target_pdf_path)
 
@@ -1850,7 +2924,7 @@ def _docx_zip_replace_tags(template_path: str, out_path: str, mapping: Dict[str,
     mapping keys should be simple text like 'Date', 'Name', etc., and placeholders are [Date], [Name], etc.
     """
     placeholders = {f"[{k}]": (v or "") for k, v in mapping.items()}
-    with zipfile.ZipFile(template_path, 'r') as zin:
+    with zipfile.ZipFile(io.BytesIO(_template_bytes(template_path)), 'r') as zin:
         with zipfile.ZipFile(out_path, 'w', zipfile.ZIP_DEFLATED) as zout:
             for item in zin.infolist():
                 data = zin.read(item.filename)
@@ -1922,8 +2996,7 @@ def generate_agreement_pdf(tags: Dict[str, str], feasibility_pdf_path: str) -> T
     name_v = (tags.get("Name", "") or "").strip()
     number_v = (tags.get("Number", "") or "").strip()
     address_v = (tags.get("Address", "") or "").strip()
-    conn = get_conn()
-    try:
+    with get_reader() as conn:
         cur = conn.cursor()
         cur.execute(
             """
@@ -1938,26 +3011,27 @@ def generate_agreement_pdf(tags: Dict[str, str], feasibility_pdf_path: str) -> T
         dup = cur.fetchone()
         if dup:
             raise DuplicateAgreementError(f"Duplicate exists with Agreement No: {dup[1]}")
-    finally:
-        conn.close()
-
-    conn = get_conn()
-    try:
-        agreement_no = _next_agreement_no(conn)
-    finally:
-        conn.close()
 
     template_path = os.path.join(os.getcwd(), "templates", "agreement template.docx")
     if not os.path.exists(template_path):
         raise FileNotFoundError("templates/agreement template.docx not found")
 
+    # Reserved on the writer, so two concurrent creates never get the same number
+    with get_writer() as conn:
+        agreement_no = _next_agreement_no(conn)
+    try:
+        return _generate_agreement_with_number(tags, feasibility_pdf_path, template_path, agreement_no)
+    except BaseException:
+        with get_writer() as conn:
+            _release_agreement_no(conn, agreement_no)
+        raise
+
+
+def _generate_agreement_with_number(
+    tags: Dict[str, str], feasibility_pdf_path: str, template_path: str, agreement_no: str
+) -> Tuple[Optional[str], Optional[str], str]:
     base = safe_filename(agreement_no)
     temp_docx = os.path.join(DOCX_DIR, f"{base}.docx")
-    try:
-        if os.path.exists(temp_docx):
-            os.remove(temp_docx)
-    except Exception:
-        pass
     # XML-level replace preserves formatting and updates everywhere (including text boxes)
     _docx_zip_replace_tags(template_path, temp_docx, {
         "Date": tags.get("Date", ""),
@@ -2011,24 +3085,14 @@ def generate_agreement_pdf(tags: Dict[str, str], feasibility_pdf_path: str) -> T
         pass
 
     target_pdf = os.path.join(AGREEMENT_PDF_DIR, f"{base}.pdf")
-    try:
-        if os.path.exists(target_pdf):
-            os.remove(target_pdf)
-    except Exception:
-        pass
     # Use Word-first for agreements to preserve template formatting
     pdf_path = _convert_to_pdf_word_first(temp_docx, target_pdf)
 
     # If conversion failed, keep DOCX so user can download; else delete temp DOCX
     if pdf_path:
-        try:
-            if os.path.exists(temp_docx):
-                os.remove(temp_docx)
-        except Exception:
-            pass
+        _remove_quietly(temp_docx)
 
-    conn = get_conn()
-    try:
+    with get_writer() as conn:
         conn.execute(
             """
             INSERT INTO agreements (agreement_no, name, number, address, date, feasibility_pdf_path, agreement_pdf_path, created_at)
@@ -2045,16 +3109,12 @@ def generate_agreement_pdf(tags: Dict[str, str], feasibility_pdf_path: str) -> T
                 datetime.now().isoformat(timespec="seconds"),
             ),
         )
-        conn.commit()
-    finally:
-        conn.close()
 
     return None, pdf_path, agreement_no
 
 
 def load_agreements() -> pd.DataFrame:
-    conn = get_conn()
-    try:
+    with get_reader() as conn:
         df = pd.read_sql_query(
             """
             SELECT id, agreement_no, name, number, address, date, feasibility_pdf_path, agreement_pdf_path, created_at
@@ -2063,15 +3123,12 @@ def load_agreements() -> pd.DataFrame:
             """,
             conn,
         )
-    finally:
-        conn.close()
     return df
 
 
 def fetch_agreement_record(agr_id: int) -> Optional[Dict[str, str]]:
     """Fetch a single agreement record by id as a dict."""
-    conn = get_conn()
-    try:
+    with get_reader() as conn:
         cur = conn.cursor()
         cur.execute(
             """
@@ -2094,36 +3151,23 @@ def fetch_agreement_record(agr_id: int) -> Optional[Dict[str, str]]:
             "agreement_pdf_path": r[7],
             "created_at": r[8],
         }
-    finally:
-        conn.close()
 
 
 def delete_agreement(agr_id: int) -> None:
     """Delete an agreement row and both associated PDFs (feasibility and agreement).
     This ensures a clean slate so re-creating does not hit UNIQUE/leftover-file issues.
     """
-    conn = get_conn()
-    try:
-        cur = conn.cursor()
-        cur.execute("SELECT feasibility_pdf_path, agreement_pdf_path FROM agreements WHERE id=?", (agr_id,))
-        row = cur.fetchone()
-        if row:
-            feas, agrpdf = row
-            # Delete both PDFs if they exist
-            try:
-                if agrpdf and os.path.exists(agrpdf):
-                    os.remove(agrpdf)
-            except Exception:
-                pass
-            try:
-                if feas and os.path.exists(feas):
-                    os.remove(feas)
-            except Exception:
-                pass
-        conn.execute("DELETE FROM agreements WHERE id=?", (agr_id,))
-        conn.commit()
-    finally:
-        conn.close()
+    with get_writer() as conn:
+        row = conn.execute(
+            "DELETE FROM agreements WHERE id=? RETURNING feasibility_pdf_path, agreement_pdf_path", (agr_id,)
+        ).fetchone()
+    if row:
+        feas, agrpdf = row
+        # Delete both PDFs if they exist
+        _unpublish_pdf(agrpdf)
+        _unpublish_pdf(feas)
+        _remove_quietly(agrpdf)
+        _remove_quietly(feas)
 
 
 def render_upload_feasibility_tab():
@@ -2145,7 +3189,7 @@ def render_upload_feasibility_tab():
             except Exception:
                 st.info("Preview not available.")
 
-        text = _read_pdf_text(pdf_bytes)
+        text = _read_pdf_text(pdf_bytes, enough=_feasibility_fields_found)
         tags = _extract_fields_from_text(text)
 
         with cform:
@@ -2176,14 +3220,13 @@ def render_upload_feasibility_tab():
                     st.success(f"Agreement generated: {agr_no}")
                     st.markdown("#### Preview: Agreement")
                     _render_pdf_preview(agr_pdf, height=480)
-                    with open(agr_pdf, "rb") as f:
-                        st.download_button(
-                            "⬇️  Download Agreement PDF",
-                            data=f.read(),
-                            file_name=os.path.basename(agr_pdf),
-                            mime="application/pdf",
-                            use_container_width=True,
-                        )
+                    st.download_button(
+                        "⬇️  Download Agreement PDF",
+                        data=_file_bytes(agr_pdf),
+                        file_name=os.path.basename(agr_pdf),
+                        mime="application/pdf",
+                        use_container_width=True,
+                    )
                     _render_mobile_share_button(agr_pdf, os.path.basename(agr_pdf))
                 else:
                     st.error("Failed to generate agreement PDF. Ensure MS Word or LibreOffice is installed for DOCX→PDF conversion.")
@@ -2254,6 +3297,8 @@ def render_generated_agreements_tab():
         except Exception:
             pass
 
+    file_exists = _exists_checker(FEASIBILITY_DIR, AGREEMENT_PDF_DIR)
+
     mobile_view = st.toggle("Mobile card view", value=True, key="agreements_mobile_card_toggle")
 
     # Light CSS similar to Search Invoice
@@ -2269,10 +3314,12 @@ def render_generated_agreements_tab():
     )
 
     if mobile_view:
-        for _, row in filtered.iterrows():
+        for row in filtered.to_dict("records"):
             rid = int(row["id"])
-            pdf_ag = row.get("agreement_pdf_path") if "agreement_pdf_path" in row else None
-            pdf_feas = row.get("feasibility_pdf_path") if "feasibility_pdf_path" in row else None
+            pdf_ag = row.get("agreement_pdf_path")
+            pdf_feas = row.get("feasibility_pdf_path")
+            have_ag = file_exists(pdf_ag)
+            have_feas = file_exists(pdf_feas)
             with st.container(border=True):
                 top_l, _ = st.columns([7, 3])
                 with top_l:
@@ -2282,25 +3329,23 @@ def render_generated_agreements_tab():
                 # Row 1: Preview buttons
                 p1, p2 = st.columns([1, 1])
                 with p1:
-                    if st.button("👁️  Preview Feasibility", key=f"ga_prev_f_{rid}", use_container_width=True, disabled=not (pdf_feas and os.path.exists(pdf_feas))):
+                    if st.button("👁️  Preview Feasibility", key=f"ga_prev_f_{rid}", use_container_width=True, disabled=not have_feas):
                         st.session_state["agr_preview_feas_id"] = rid
                 with p2:
-                    if st.button("👁️  Preview Agreement", key=f"ga_prev_a_{rid}", use_container_width=True, disabled=not (pdf_ag and os.path.exists(pdf_ag))):
+                    if st.button("👁️  Preview Agreement", key=f"ga_prev_a_{rid}", use_container_width=True, disabled=not have_ag):
                         st.session_state["agr_preview_id"] = rid
                         st.session_state.pop("agr_preview_feas_id", None)
 
                 # Row 2: Download Feasibility, Download Agreement, Edit, Share, Delete
                 a1, a2, a3, a4, a5 = st.columns([1, 1, 1, 1, 1])
                 with a1:
-                    if pdf_feas and os.path.exists(pdf_feas):
-                        with open(pdf_feas, "rb") as f:
-                            st.download_button("⬇️  Download Feasibility", data=f.read(), file_name=os.path.basename(pdf_feas), mime="application/pdf", key=f"ga_dl_feas_{rid}", use_container_width=True)
+                    if have_feas:
+                        st.download_button("⬇️  Download Feasibility", data=_file_bytes(pdf_feas), file_name=os.path.basename(pdf_feas), mime="application/pdf", key=f"ga_dl_feas_{rid}", use_container_width=True)
                     else:
                         st.button("⬇️  Download Feasibility", disabled=True, key=f"ga_dl_feas_na_{rid}", use_container_width=True)
                 with a2:
-                    if pdf_ag and os.path.exists(pdf_ag):
-                        with open(pdf_ag, "rb") as f:
-                            st.download_button("⬇️  Download Agreement", data=f.read(), file_name=os.path.basename(pdf_ag), mime="application/pdf", key=f"ga_dl_ag_{rid}", use_container_width=True)
+                    if have_ag:
+                        st.download_button("⬇️  Download Agreement", data=_file_bytes(pdf_ag), file_name=os.path.basename(pdf_ag), mime="application/pdf", key=f"ga_dl_ag_{rid}", use_container_width=True)
                     else:
                         st.button("⬇️  Download Agreement", disabled=True, key=f"ga_dl_ag_na_{rid}", use_container_width=True)
                 with a3:
@@ -2310,7 +3355,7 @@ def render_generated_agreements_tab():
                         st.session_state.pop("agr_preview_feas_id", None)
                         st.rerun()
                 with a4:
-                    if pdf_ag and os.path.exists(pdf_ag):
+                    if have_ag:
                         _render_mobile_share_button(pdf_ag, os.path.basename(pdf_ag))
                     else:
                         st.button("Share PDF", disabled=True, key=f"ga_share_na_{rid}", use_container_width=True)
@@ -2325,12 +3370,12 @@ def render_generated_agreements_tab():
                         st.rerun()
 
                 # Inline previews (full-width inside this card)
-                if st.session_state.get("agr_preview_feas_id") == rid and pdf_feas and os.path.exists(pdf_feas):
+                if st.session_state.get("agr_preview_feas_id") == rid and have_feas:
                     _render_pdf_preview(pdf_feas, height=780)
                     if st.button("Close Feasibility preview", key=f"ga_close_prev_f_{rid}"):
                         st.session_state.pop("agr_preview_feas_id", None)
                         st.rerun()
-                if st.session_state.get("agr_preview_id") == rid and pdf_ag and os.path.exists(pdf_ag):
+                if st.session_state.get("agr_preview_id") == rid and have_ag:
                     _render_pdf_preview(pdf_ag, height=780)
                     if st.button("Close Agreement preview", key=f"ga_close_prev_{rid}"):
                         st.session_state.pop("agr_preview_id", None)
@@ -2361,7 +3406,7 @@ def render_generated_agreements_tab():
         return
 
     # Desktop-like layout (header + rows)
-    h1, h2, h3, h4, h5 = st.columns([2.5, 2.5, 2, 2, 2])
+    h1, h2, h3, h4, h5 = st.columns(RESULTS_HEADER_SPEC)
     with h1:
         st.markdown("**Customer**")
     with h2:
@@ -2373,11 +3418,13 @@ def render_generated_agreements_tab():
     with h5:
         st.markdown("**Action**")
 
-    for _, row in filtered.iterrows():
+    for row in filtered.to_dict("records"):
         rid = int(row["id"])
-        pdf_ag = row.get("agreement_pdf_path") if "agreement_pdf_path" in row else None
-        pdf_feas = row.get("feasibility_pdf_path") if "feasibility_pdf_path" in row else None
-        c1, c2, c3, c4, c5 = st.columns([2.5, 2.5, 2, 2, 2])
+        pdf_ag = row.get("agreement_pdf_path")
+        pdf_feas = row.get("feasibility_pdf_path")
+        have_ag = file_exists(pdf_ag)
+        have_feas = file_exists(pdf_feas)
+        c1, c2, c3, c4, a1, a2, a3, a4, a5 = st.columns(RESULTS_ROW_SPEC)
         with c1:
             st.write(row["name"])  
         with c2:
@@ -2386,43 +3433,39 @@ def render_generated_agreements_tab():
             st.write(row.get("date", "")) 
         with c4:
             st.write(row.get("number", "")) 
-        with c5:
-            a1, a2, a3, a4, a5 = st.columns([1, 1, 1, 1, 1])
-            with a1:
-                # Preview both (Agreement prioritized), then Feasibility below inline
-                if st.button("👁️", key=f"ga_d_prev_{rid}", use_container_width=True):
-                    st.session_state["agr_preview_id"] = rid
-            with a2:
-                if pdf_feas and os.path.exists(pdf_feas):
-                    with open(pdf_feas, "rb") as f:
-                        st.download_button("⬇️ F", f.read(), file_name=os.path.basename(pdf_feas), key=f"ga_d_dl_f_{rid}", use_container_width=True)
-                else:
-                    st.button("⬇️ F", disabled=True, key=f"ga_d_dl_f_na_{rid}", use_container_width=True)
-            with a3:
-                if pdf_ag and os.path.exists(pdf_ag):
-                    with open(pdf_ag, "rb") as f:
-                        st.download_button("⬇️ A", f.read(), file_name=os.path.basename(pdf_ag), key=f"ga_d_dl_a_{rid}", use_container_width=True)
-                else:
-                    st.button("⬇️ A", disabled=True, key=f"ga_d_dl_a_na_{rid}", use_container_width=True)
-            with a4:
-                if st.button("✏️", key=f"ga_d_edit_{rid}", use_container_width=True):
-                    st.session_state["agr_edit_id"] = rid
-                    st.session_state.pop("agr_preview_id", None)
-                    st.rerun()
-            with a5:
-                if st.button("🗑️", key=f"ga_d_del_{rid}", use_container_width=True):
-                    st.session_state.pop("agr_preview_id", None)
-                    st.session_state.pop("agr_edit_id", None)
-                    delete_agreement(rid)
-                    st.success("Deleted.")
-                    st.rerun()
+        with a1:
+            # Preview both (Agreement prioritized), then Feasibility below inline
+            if st.button("👁️", key=f"ga_d_prev_{rid}", use_container_width=True):
+                st.session_state["agr_preview_id"] = rid
+        with a2:
+            if have_feas:
+                st.download_button("⬇️ F", _file_bytes(pdf_feas), file_name=os.path.basename(pdf_feas), key=f"ga_d_dl_f_{rid}", use_container_width=True)
+            else:
+                st.button("⬇️ F", disabled=True, key=f"ga_d_dl_f_na_{rid}", use_container_width=True)
+        with a3:
+            if have_ag:
+                st.download_button("⬇️ A", _file_bytes(pdf_ag), file_name=os.path.basename(pdf_ag), key=f"ga_d_dl_a_{rid}", use_container_width=True)
+            else:
+                st.button("⬇️ A", disabled=True, key=f"ga_d_dl_a_na_{rid}", use_container_width=True)
+        with a4:
+            if st.button("✏️", key=f"ga_d_edit_{rid}", use_container_width=True):
+                st.session_state["agr_edit_id"] = rid
+                st.session_state.pop("agr_preview_id", None)
+                st.rerun()
+        with a5:
+            if st.button("🗑️", key=f"ga_d_del_{rid}", use_container_width=True):
+                st.session_state.pop("agr_preview_id", None)
+                st.session_state.pop("agr_edit_id", None)
+                delete_agreement(rid)
+                st.success("Deleted.")
+                st.rerun()
 
         # Inline previews (full-width below row)
         if st.session_state.get("agr_preview_id") == rid:
-            if pdf_feas and os.path.exists(pdf_feas):
+            if have_feas:
                 st.markdown("Feasibility Preview")
                 _render_pdf_preview(pdf_feas, height=780)
-            if pdf_ag and os.path.exists(pdf_ag):
+            if have_ag:
                 st.markdown("Agreement Preview")
                 _render_pdf_preview(pdf_ag, height=780)
             if st.button("Close preview", key=f"ga_d_close_prev_{rid}"):
@@ -2459,7 +3502,8 @@ def main():
     st.title(APP_TITLE)
 
     ensure_dirs()
-    _ = get_conn()  # ensure DB exists
+    _get_pool()  # ensure DB exists
+    _prewarm_unoserver()
 
     # Sidebar navigation drawer
     st.sidebar.title("Navigation")
@@ -2491,6 +3535,59 @@ def main():
 # UI helpers
 # ---------------------------
 
+def _day_after(d) -> str:
+    return (d + timedelta(days=1)).isoformat()
+
+
+@st.cache_data(show_spinner=False, max_entries=8)
+def _dashboard_totals(gen: int, buckets: Tuple[Tuple[str, str], ...]) -> Dict[str, object]:
+    """Headline invoice counts in one aggregate query. `buckets` are half-open
+    [start, next-day) ISO bounds; date_of_quotation is stored as YYYY-MM-DD so
+    plain string comparison stays on the index."""
+    bucket_sql = "".join(
+        ", COALESCE(SUM(date_of_quotation >= ? AND date_of_quotation < ?), 0)" for _ in buckets
+    )
+    params = [v for pair in buckets for v in pair]
+    with get_reader() as conn:
+        row = conn.execute(
+            f"""
+            SELECT COUNT(*),
+                   COALESCE(SUM(pdf_path IS NOT NULL AND pdf_path <> ''), 0),
+                   COUNT(DISTINCT customer_name){bucket_sql}
+            FROM invoices
+            """,
+            params,
+        ).fetchone()
+    return {"total": row[0], "with_pdf": row[1], "customers": row[2], "buckets": list(row[3:])}
+
+
+@st.cache_data(show_spinner=False, max_entries=16)
+def _dashboard_range(gen: int, start: str, stop: str) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """Per-product and per-day invoice counts for date_of_quotation in [start, stop)."""
+    with get_reader() as conn:
+        by_product = pd.read_sql_query(
+            """
+            SELECT product, COUNT(*) AS count FROM invoices
+            WHERE date_of_quotation >= ? AND date_of_quotation < ?
+            GROUP BY product ORDER BY count DESC
+            """,
+            conn,
+            params=(start, stop),
+        )
+        by_day = pd.read_sql_query(
+            """
+            SELECT substr(date_of_quotation, 1, 10) AS day, COUNT(*) AS count FROM invoices
+            WHERE date_of_quotation >= ? AND date_of_quotation < ?
+            GROUP BY day ORDER BY day
+            """,
+            conn,
+            params=(start, stop),
+        )
+    by_day["day"] = pd.to_datetime(by_day["day"], format="%Y-%m-%d", errors="coerce")
+    by_day = by_day.dropna(subset=["day"]).set_index("day")
+    return by_product, by_day
+
+
 def render_dashboard():
     st.subheader("Dashboard")
 
@@ -2506,38 +3603,7 @@ def render_dashboard():
         unsafe_allow_html=True,
     )
 
-    # Load data for dashboard with broader columns
-    conn = get_conn()
-    try:
-        df = pd.read_sql_query(
-            """
-            SELECT id, customer_name, product, date_of_quotation, quotation_no, pdf_path, created_at
-            FROM invoices
-            ORDER BY id DESC
-            """,
-            conn,
-        )
-    finally:
-        conn.close()
-
-    if df.empty:
-        st.info("No invoices yet. Showing Agreements & Feasibility stats if available.")
-        # Create an empty frame with expected columns to keep downstream logic intact
-        df = pd.DataFrame(columns=[
-            "id", "customer_name", "product", "date_of_quotation", "quotation_no", "pdf_path", "created_at"
-        ])
-
-    # Normalize dates
-    def to_date(x):
-        try:
-            return datetime.strptime(str(x), "%Y-%m-%d").date()
-        except Exception:
-            try:
-                return datetime.fromisoformat(str(x)).date()
-            except Exception:
-                return None
-    df["date_of_quotation"] = df["date_of_quotation"].apply(to_date)
-
+    gen = _invoices_gen()
     today = datetime.now().date()
     yesterday = today - timedelta(days=1)
     week_start = today - timedelta(days=today.weekday())  # Monday
@@ -2578,24 +3644,32 @@ def render_dashboard():
         dr = st.date_input("Select date or range", value=(week_start, week_end))
         if isinstance(dr, tuple) and len(dr) == 2:
             start_date, end_date = dr
+        elif isinstance(dr, tuple):
+            # Range picker mid-selection: only the first day chosen so far
+            start_date = end_date = dr[0] if dr else None
         else:
             start_date = dr
             end_date = dr
 
-    # Filter
-    df_valid = df.dropna(subset=["date_of_quotation"]).copy()
+    # Counts come from aggregate queries; no invoice rows are pulled into pandas
+    totals = _dashboard_totals(gen, (
+        (today.isoformat(), _day_after(today)),
+        (yesterday.isoformat(), _day_after(yesterday)),
+        (week_start.isoformat(), _day_after(week_end)),
+        (month_start.isoformat(), _day_after(month_end)),
+    ))
+    if not totals["total"]:
+        st.info("No invoices yet. Showing Agreements & Feasibility stats if available.")
     if start_date and end_date:
-        mask = (df_valid["date_of_quotation"] >= start_date) & (df_valid["date_of_quotation"] <= end_date)
-        df_view = df_valid[mask]
+        prod_counts, daily_counts = _dashboard_range(gen, start_date.isoformat(), _day_after(end_date))
     else:
-        df_view = df_valid
+        prod_counts, daily_counts = _dashboard_range(gen, "0000-01-01", "9999-12-31")
 
     # Metrics row
-    total_invoices = len(df)
-    # Count rows that have a non-empty pdf_path (fix parentheses to sum the boolean mask)
-    total_with_pdf = int(((df["pdf_path"].notna()) & (df["pdf_path"] != "")).sum()) if "pdf_path" in df.columns else 0
-    selected_count = len(df_view)
-    unique_customers = df["customer_name"].nunique()
+    total_invoices = totals["total"]
+    total_with_pdf = totals["with_pdf"]
+    selected_count = int(prod_counts["count"].sum())
+    unique_customers = totals["customers"]
 
     m1, m2, m3, m4 = st.columns(4)
     with m1:
@@ -2626,16 +3700,13 @@ def render_dashboard():
             return None
 
     # Agreements created count by created_at within range
-    conn = get_conn()
-    try:
+    with get_reader() as conn:
         df_ag = pd.read_sql_query(
             """
             SELECT id, created_at FROM agreements ORDER BY id DESC
             """,
             conn,
         )
-    finally:
-        conn.close()
     if not df_ag.empty:
         df_ag["created_date"] = df_ag["created_at"].apply(_to_date_any)
         df_ag_valid = df_ag.dropna(subset=["created_date"]).copy()
@@ -2675,21 +3746,20 @@ def render_dashboard():
         st.metric("Agreements Created (range)", agreements_in_range)
 
     # Quick glance mini-counters
-    def count_in(d0, d1):
-        return int(((df_valid["date_of_quotation"] >= d0) & (df_valid["date_of_quotation"] <= d1)).sum())
+    n_today, n_yesterday, n_week, n_month = totals["buckets"]
     q1, q2, q3, q4 = st.columns(4)
     with q1:
         st.caption("Today")
-        st.write(count_in(today, today))
+        st.write(n_today)
     with q2:
         st.caption("Yesterday")
-        st.write(count_in(yesterday, yesterday))
+        st.write(n_yesterday)
     with q3:
         st.caption("This Week")
-        st.write(count_in(week_start, week_end))
+        st.write(n_week)
     with q4:
         st.caption("This Month")
-        st.write(count_in(month_start, month_end))
+        st.write(n_month)
 
     # Charts
     st.markdown("### Charts")
@@ -2698,12 +3768,8 @@ def render_dashboard():
     with ch1:
         st.markdown("#### Invoices by Product")
         try:
-            prod_counts = (
-                df_view.groupby("product").size().reset_index(name="count").sort_values("count", ascending=False)
-            )
             if not prod_counts.empty:
-                prod_counts = prod_counts.set_index("product")
-                st.bar_chart(prod_counts["count"])
+                st.bar_chart(prod_counts.set_index("product")["count"])
             else:
                 st.caption("No data for selected range.")
         except Exception:
@@ -2712,11 +3778,7 @@ def render_dashboard():
     with ch2:
         st.markdown("#### Invoices over Time")
         try:
-            daily_counts = (
-                df_view.groupby("date_of_quotation").size().reset_index(name="count").sort_values("date_of_quotation")
-            )
             if not daily_counts.empty:
-                daily_counts = daily_counts.set_index("date_of_quotation")
                 st.line_chart(daily_counts["count"])
             else:
                 st.caption("No data for selected range.")
@@ -2728,11 +3790,9 @@ def render_dashboard():
     # Additional: Distribution by Day of Week
     st.markdown("#### Distribution by Day of Week")
     try:
-        dts = pd.to_datetime(df_view["date_of_quotation"], errors="coerce")
-        dow = dts.dt.day_name()
         order = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
         dow_counts = (
-            dow.value_counts().reindex(order).fillna(0).astype(int)
+            daily_counts["count"].groupby(daily_counts.index.day_name()).sum().reindex(order).fillna(0).astype(int)
         )
         if dow_counts.sum() > 0:
             st.bar_chart(dow_counts)
@@ -2743,6 +3803,17 @@ def render_dashboard():
 
     # Invoices section intentionally removed
 
+@st.fragment(run_every=0.5)
+def _poll_pdf_job(job_key: str) -> None:
+    """Progress bar for a save running on the PDF executor. Only this fragment reruns while
+    it waits; once the job is done the whole app reruns so the form renders the result."""
+    job = st.session_state.get(job_key)
+    if job is None or job[0].done():
+        st.rerun()
+    elapsed = time.monotonic() - job[1]
+    st.progress(min(10 + int(elapsed * 10), 65), text="Generating PDF…")
+
+
 def render_create_form(
     prefill: Optional[Dict[str, str]] = None,
     edit_id: Optional[int] = None,
@@ -2750,14 +3821,12 @@ def render_create_form(
     form_title: Optional[str] = None,
     key_ns: Optional[str] = None,
 ):
-    conn = get_conn()
-    try:
+    with get_reader() as conn:
         qno_preview = next_quotation_no(conn) if edit_id is None else None
-    finally:
-        conn.close()
 
     # establish a namespace for widget keys to avoid collisions across tabs/forms
     ns = key_ns or (f"edit_{edit_id}" if edit_id is not None else "new")
+    job_key = f"{ns}_pdf_job"
 
     if edit_id is None:
         st.subheader(form_title or "Create New Invoice")
@@ -2823,7 +3892,8 @@ def render_create_form(
         submit_label = "Update Invoice" if edit_id is not None else "Create Invoice"
         submitted = st.form_submit_button(submit_label)
 
-    if submitted:
+    # A save still running keeps its progress bar; a second click must not start another one
+    if submitted and job_key not in st.session_state:
         data = {
             "product": product,
             "customer_name": customer_name.strip(),
@@ -2839,60 +3909,253 @@ def render_create_form(
             "application_reference": application_reference.strip(),
             "electricity_connection_no": electricity_connection_no.strip(),
         }
-        # Minimal progress UI (non-intrusive)
-        prog = st.progress(0, text="Starting…")
-        status = st.empty()
-        try:
-            prog.progress(10, text="Processing invoice…")
-            status.write("Generating files…")
-            # choose template based on selected product
-            template_path = _template_for_product(product)
-            if edit_id is None:
-                docx_path, pdf_path = create_invoice(data, template_path)
-                prog.progress(70, text="Finalizing creation…")
-                st.success("Invoice created successfully.")
-                st.toast(f"Saved invoice {qno_preview}", icon="✅")
-            else:
-                docx_path, pdf_path = edit_invoice(edit_id, data, template_path)
-                prog.progress(70, text="Finalizing update…")
-                st.success("Invoice updated successfully.")
-                st.toast("Invoice updated", icon="✏️")
+        # Generate + convert on the PDF executor; this run (and every other session) carries on
+        template_path = _template_for_product(product)
+        if edit_id is None:
+            fut = _run_in_background(create_invoice, data, template_path)
+        else:
+            fut = _run_in_background(edit_invoice, edit_id, data, template_path)
+        st.session_state[job_key] = (fut, time.monotonic())
+
+    job = st.session_state.get(job_key)
+    if job is None:
+        return
+    fut = job[0]
+    if not fut.done():
+        _poll_pdf_job(job_key)
+        return
+    st.session_state.pop(job_key, None)
+
+    # Minimal progress UI (non-intrusive)
+    prog = st.progress(70, text="Finalizing…")
+    try:
+        if edit_id is None:
+            docx_path, pdf_path, qno = fut.result()
+            prog.progress(80, text="Finalizing creation…")
+            st.success("Invoice created successfully.")
+            # The number actually allocated, which can differ from the preview under concurrent saves
+            st.toast(f"Saved invoice {qno}", icon="✅")
+        else:
+            docx_path, pdf_path = fut.result()
+            prog.progress(100, text="Done")
+            st.session_state.pop("selected_edit_id", None)
             if pdf_path and os.path.exists(pdf_path):
-                # Inline preview of the generated PDF
-                _render_pdf_preview(pdf_path, height=480)
-                # Actions: Download + Share side-by-side
-                cdl, csh = st.columns([1, 1])
-                with cdl:
-                    with open(pdf_path, "rb") as f:
-                        prog.progress(90, text="Preparing download…")
-                        st.download_button(
-                            "⬇️  Download",
-                            data=f.read(),
-                            file_name=os.path.basename(pdf_path),
-                            mime="application/pdf",
-                            use_container_width=True,
-                        )
-                with csh:
-                    _render_mobile_share_button(pdf_path, os.path.basename(pdf_path))
-                prog.progress(100, text="Done")
+                # Reopen the row with its regenerated PDF in the inline preview
+                st.session_state["preview_id"] = int(edit_id)
+                st.toast("Invoice updated", icon="✏️")
             else:
-                prog.progress(100, text="Completed (PDF unavailable)")
-                if docx_path and isinstance(docx_path, str) and os.path.exists(docx_path):
-                    st.warning("PDF conversion failed. Download the DOCX and export to PDF using Word/LibreOffice. You can also install LibreOffice or MS Word to enable automatic PDF generation.")
-                    with open(docx_path, "rb") as f:
-                        st.download_button(
-                            "⬇️  Download DOCX",
-                            data=f.read(),
-                            file_name=os.path.basename(docx_path),
-                            mime="application/vnd.openxmlformats-officedocument.wordprocessingml.document",
-                            use_container_width=True,
-                        )
-                    st.caption("Tip: On Windows, installing MS Word usually enables automatic PDF conversion via docx2pdf. Alternatively, install LibreOffice and set environment variable LIBREOFFICE_PATH to the soffice.exe.")
-                else:
-                    st.warning("PDF conversion failed or Word is not available. Please try again on a system with MS Word or LibreOffice installed.")
-        except Exception as e:
-            prog.progress(100, text="Failed")
-            st.error(f"Failed to process invoice: {e}")
+                st.toast("Invoice updated, but the PDF could not be regenerated.", icon="⚠️")
+            # Full rerun, as for deletes: the results list is fetched outside the fragment,
+            # so a fragment rerun would keep showing the old values
+            st.rerun()
+        if pdf_path and os.path.exists(pdf_path):
+            # Inline preview of the generated PDF
+            _render_pdf_preview(pdf_path, height=480)
+            # Actions: Download + Share side-by-side
+            cdl, csh = st.columns([1, 1])
+            with cdl:
+                prog.progress(90, text="Preparing download…")
+                st.download_button(
+                    "⬇️  Download",
+                    data=_file_bytes(pdf_path),
+                    file_name=os.path.basename(pdf_path),
+                    mime="application/pdf",
+                    use_container_width=True,
+                )
+            with csh:
+                _render_mobile_share_button(pdf_path, os.path.basename(pdf_path))
+            prog.progress(100, text="Done")
+        else:
+            prog.progress(100, text="Completed (PDF unavailable)")
+            if docx_path and isinstance(docx_path, str) and os.path.exists(docx_path):
+                st.warning("PDF conversion failed. Download the DOCX and export to PDF using Word/LibreOffice. You can also install LibreOffice or MS Word to enable automatic PDF generation.")
+                st.download_button(
+                    "⬇️  Download DOCX",
+                    data=_file_bytes(docx_path),
+                    file_name=os.path.basename(docx_path),
+                    mime="application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+                    use_container_width=True,
+                )
+                st.caption("Tip: On Windows, installing MS Word usually enables automatic PDF conversion via docx2pdf. Alternatively, install LibreOffice and set environment variable LIBREOFFICE_PATH to the soffice.exe.")
+            else:
+                st.warning("PDF conversion failed or Word is not available. Please try again on a system with MS Word or LibreOffice installed.")
+    except Exception as e:
+        prog.progress(100, text="Failed")
+        st.error(f"Failed to process invoice: {e}")
+
+
+RESULTS_PAGE_SIZE = 25
+# Desktop result tables: the header's Action column spans the five
+# per-row action slots, so rows need a single flat st.columns call.
+RESULTS_HEADER_SPEC = (2.5, 2.5, 2, 2, 2)
+RESULTS_ROW_SPEC = (2.5, 2.5, 2, 2, 0.4, 0.4, 0.4, 0.4, 0.4)
+# Invoice rows add a leading selection checkbox for bulk delete
+INVOICE_HEADER_SPEC = (0.4,) + RESULTS_HEADER_SPEC
+INVOICE_ROW_SPEC = (0.4,) + RESULTS_ROW_SPEC
+
+
+def _page_window(rows: List[Dict[str, object]], key: str, reset_on: object) -> Tuple[List[Dict[str, object]], int, int]:
+    """Slice out the current page of `rows` (page index kept in session_state[key]).
+    The page resets to the first one whenever `reset_on` (e.g. the active filters) changes."""
+    sig_key = f"{key}_sig"
+    if st.session_state.get(sig_key) != reset_on:
+        st.session_state[sig_key] = reset_on
+        st.session_state[key] = 0
+    pages = max(1, -(-len(rows) // RESULTS_PAGE_SIZE))
+    page = min(max(int(st.session_state.get(key, 0)), 0), pages - 1)
+    st.session_state[key] = page
+    return rows[page * RESULTS_PAGE_SIZE:(page + 1) * RESULTS_PAGE_SIZE], page, pages
+
+
+def _rerun_fragment() -> None:
+    """Rerun just the enclosing st.fragment; falls back to a full rerun when the current run
+    is not a fragment run (e.g. the click was processed by a full-app run)."""
+    try:
+        st.rerun(scope="fragment")
+    except StreamlitAPIException:
+        st.rerun()
+
+
+def _page_controls(key: str, page: int, pages: int) -> None:
+    if pages <= 1:
+        return
+    c_prev, c_next, c_info = st.columns([1, 1, 6])
+    with c_prev:
+        if st.button("◀ Prev", key=f"{key}_prev", disabled=page == 0, use_container_width=True):
+            st.session_state[key] = page - 1
+            _rerun_fragment()
+    with c_next:
+        if st.button("Next ▶", key=f"{key}_next", disabled=page >= pages - 1, use_container_width=True):
+            st.session_state[key] = page + 1
+            _rerun_fragment()
+    with c_info:
+        st.caption(f"Page {page + 1} of {pages}")
+
+
+def _selected_invoices() -> set:
+    """Invoice ids ticked for bulk delete; kept across pages and fragment reruns."""
+    return st.session_state.setdefault("invoice_sel", set())
+
+
+def _toggle_selected(rid: int) -> None:
+    if st.session_state.get(f"inv_sel_{rid}"):
+        _selected_invoices().add(rid)
+    else:
+        _selected_invoices().discard(rid)
+
+
+def _select_checkbox(rid: int, show_label: bool = True) -> None:
+    st.checkbox(
+        "Select",
+        value=rid in _selected_invoices(),
+        key=f"inv_sel_{rid}",
+        on_change=_toggle_selected,
+        args=(rid,),
+        label_visibility="visible" if show_label else "collapsed",
+    )
+
+
+def _clear_selection() -> None:
+    _selected_invoices().clear()
+    st.session_state.pop("invoice_zip", None)
+    for k in [k for k in st.session_state if str(k).startswith("inv_sel_")]:
+        del st.session_state[k]
+
+
+def _bulk_actions_bar() -> None:
+    """Actions on the ticked invoices. 'Delete selected' is one DELETE ... WHERE id IN (...)
+    and a single rerun, instead of one delete + full rerun per row; 'Export selected' builds
+    one ZIP of their PDFs."""
+    sel = _selected_invoices()
+    if not sel:
+        return
+    c_del, c_zip, c_clear, _ = st.columns([2, 2, 1, 3])
+    with c_del:
+        if st.button(f"🗑️ Delete selected ({len(sel)})", key="inv_bulk_del", use_container_width=True):
+            n = delete_invoices(sorted(sel))
+            _clear_selection()
+            st.session_state.pop("preview_id", None)
+            st.session_state.pop("selected_edit_id", None)
+            st.success(f"Deleted {n} invoice(s).")
+            st.rerun()
+    with c_zip:
+        # Built on request only; download_button needs its bytes up front on every rerun
+        sig = tuple(sorted(sel))
+        ready = st.session_state.get("invoice_zip")
+        if ready and ready[0] != sig:
+            # Selection changed since the ZIP was built; don't keep its bytes around
+            st.session_state.pop("invoice_zip", None)
+            ready = None
+        if ready:
+            st.download_button(
+                f"⬇️ Download ZIP ({len(sel)})", ready[1], file_name="quotations.zip",
+                mime="application/zip", key="inv_bulk_zip_dl", use_container_width=True,
+            )
+        elif st.button(f"📦 Export selected ({len(sel)})", key="inv_bulk_zip", use_container_width=True):
+            with st.spinner("Preparing ZIP…"):
+                data, skipped = export_invoices_zip(list(sig))
+            st.session_state["invoice_zip"] = (sig, data)
+            if skipped:
+                st.session_state["invoice_zip_skipped"] = skipped
+            _rerun_fragment()
+        skipped = st.session_state.pop("invoice_zip_skipped", None)
+        if skipped:
+            st.warning("No PDF for: " + ", ".join(skipped))
+    with c_clear:
+        if st.button("Clear selection", key="inv_bulk_clear", use_container_width=True):
+            _clear_selection()
+            _rerun_fragment()
+
+
+# Label/column pairs for the expanded invoice details
+_DETAIL_FIELDS = (
+    ("Quotation No (auto)", "quotation_no"),
+    ("Product & Service", "product"),
+    ("Customer Name", "customer_name"),
+    ("Mobile Number", "mobile"),
+    ("Location", "location"),
+    ("City", "city"),
+    ("State", "state"),
+    ("Pincode", "pincode"),
+    ("Staff Name (kept only in DB)", "staff_name"),
+    ("Date of Quotation", "date_of_quotation"),
+    ("Validity", "validity_date"),
+)
+
+
+# Static markup for the Search Invoice tab. Streamlit drops any element a rerun doesn't
+# emit again, so these are re-sent every run; keeping them as constants means the frontend
+# receives an identical element and keeps the existing DOM/iframe instead of rebuilding it.
+_SEARCH_CSS = """
+<style>
+.card-header {display:flex; justify-content:space-between; align-items:center;}
+.card-title {font-weight:600; margin: 0;}
+.meta {color:#6b7280; font-size:12px; margin: 0;}
+/* Make Streamlit buttons look compact */
+.stButton>button {padding: 0.35rem 0.6rem; border-radius:999px; font-size:13px;}
+.stDownloadButton>button {padding: 0.35rem 0.6rem; border-radius:999px; font-size:13px;}
+/* Force inline horizontal layout for buttons even on mobile */
+.stButton, .stDownloadButton {display:inline-block !important; margin: 0 8px 8px 0 !important;}
+.stButton>button, .stDownloadButton>button {min-width: 36px; height: 36px;}
+.card-block {padding-top: 0.25rem;}
+.action-links {display:flex; align-items:center; gap: 10px; flex-wrap: nowrap; margin-bottom: 16px;}
+.action-links a {text-decoration:none; color:#374151; background:#f3f4f6; padding:6px 10px; border-radius:999px; font-size:13px; display:inline-flex; align-items:center; gap:6px;}
+.action-links a:hover {background:#e5e7eb;}
+</style>
+"""
+
+_SCROLL_RESTORE_HTML = """
+<script>
+(function(){
+  const KEY = 'search_invoice_scrollY';
+  const y = sessionStorage.getItem(KEY);
+  if (y) { try { window.scrollTo(0, parseInt(y)); } catch (e) {} }
+  window.addEventListener('beforeunload', function(){
+    try { sessionStorage.setItem(KEY, String(window.scrollY)); } catch(e) {}
+  });
+})();
+</script>
+"""
 
 
 def render_search_tab():
@@ -2900,8 +4163,7 @@ def render_search_tab():
     # Process delete action if triggered via query param
     _handle_delete_via_query()
 
-    df = load_invoices()
-    if df.empty:
+    if not has_invoices():
         st.info("No invoices yet.")
         return
 
@@ -2914,15 +4176,11 @@ def render_search_tab():
     with c3:
         f_product = st.selectbox("Filter by Product", options=["All"] + PRODUCT_OPTIONS, index=0)
 
-    mask = pd.Series([True] * len(df))
-    if f_name:
-        mask &= df["customer_name"].str.contains(f_name, case=False, na=False)
-    if f_mobile:
-        mask &= df["mobile"].astype(str).str.contains(f_mobile, case=False, na=False)
-    if f_product != "All":
-        mask &= df["product"] == f_product
-
-    filtered = df[mask].reset_index(drop=True)
+    filtered = search_invoices(
+        name=f_name or None,
+        mobile=f_mobile or None,
+        product=None if f_product == "All" else f_product,
+    )
 
     # Handle action links via query params (modern API)
     qp = st.query_params
@@ -2944,6 +4202,7 @@ def render_search_tab():
                 st.session_state.pop("preview_id", None)
             elif action == "delete":
                 delete_invoice(rid)
+                _selected_invoices().discard(rid)
                 st.success("Deleted.")
             # Clear params to avoid repeat on next runs (no extra rerun here)
             st.query_params.clear()
@@ -2954,52 +4213,39 @@ def render_search_tab():
     mobile_view = st.toggle("Mobile card view", value=True, key="mobile_card_toggle")
 
     # Light CSS for compact icon buttons and spacing
-    st.markdown(
-        """
-        <style>
-        .card-header {display:flex; justify-content:space-between; align-items:center;}
-        .card-title {font-weight:600; margin: 0;}
-        .meta {color:#6b7280; font-size:12px; margin: 0;}
-        /* Make Streamlit buttons look compact */
-        .stButton>button {padding: 0.35rem 0.6rem; border-radius:999px; font-size:13px;}
-        .stDownloadButton>button {padding: 0.35rem 0.6rem; border-radius:999px; font-size:13px;}
-        /* Force inline horizontal layout for buttons even on mobile */
-        .stButton, .stDownloadButton {display:inline-block !important; margin: 0 8px 8px 0 !important;}
-        .stButton>button, .stDownloadButton>button {min-width: 36px; height: 36px;}
-        .card-block {padding-top: 0.25rem;}
-        .action-links {display:flex; align-items:center; gap: 10px; flex-wrap: nowrap; margin-bottom: 16px;}
-        .action-links a {text-decoration:none; color:#374151; background:#f3f4f6; padding:6px 10px; border-radius:999px; font-size:13px; display:inline-flex; align-items:center; gap:6px;}
-        .action-links a:hover {background:#e5e7eb;}
-        </style>
-        """,
-        unsafe_allow_html=True,
-    )
+    st.markdown(_SEARCH_CSS, unsafe_allow_html=True)
 
     # Smooth UX: preserve scroll position across reruns so actions feel inline without jump
-    components.html(
-        """
-        <script>
-        (function(){
-          const KEY = 'search_invoice_scrollY';
-          const y = sessionStorage.getItem(KEY);
-          if (y) { try { window.scrollTo(0, parseInt(y)); } catch (e) {} }
-          window.addEventListener('beforeunload', function(){
-            try { sessionStorage.setItem(KEY, String(window.scrollY)); } catch(e) {}
-          });
-        })();
-        </script>
-        """,
-        height=1,
-    )
+    components.html(_SCROLL_RESTORE_HTML, height=1)
+
+    _render_invoice_results(filtered, mobile_view, (f_name, f_mobile, f_product))
+
+
+@st.fragment
+def _render_invoice_results(filtered: List[Dict[str, object]], mobile_view: bool, filters: Tuple) -> None:
+    """Result rows of the Search Invoice tab. Runs as a fragment, so preview/edit toggles and
+    paging rerun only this list; deletes still rerun the whole app to refresh `filtered`."""
+    file_exists = _exists_checker(PDF_DIR)
+
+    # Only the current page emits widgets
+    view, page, pages = _page_window(filtered, "results_page", filters)
+    _bulk_actions_bar()
 
     if mobile_view:
-        # Card layout per row (good on mobile)
-        for _, row in filtered.iterrows():
+        # Card layout per row (good on mobile); details only for rows whose panel is open, in one query
+        open_ids = [row["id"] for row in view if st.session_state.get(f"details_open_{int(row['id'])}")]
+        page_records = fetch_records_bulk(open_ids) if open_ids else {}
+        for row in view:
             with st.container(border=True):
-                pdf_path = row.get("pdf_path") if "pdf_path" in row else None
+                pdf_path = row.get("pdf_path")
+                have_pdf = file_exists(pdf_path)
+                pdf_name = os.path.basename(pdf_path) if have_pdf else ""
 
                 # Header (no actions here to avoid vertical stacking on small screens)
-                top_l, _ = st.columns([7, 3])
+                rid = int(row["id"])
+                top_l, top_r = st.columns([7, 3])
+                with top_r:
+                    _select_checkbox(rid)
                 with top_l:
                     st.markdown(
                         f"<p class='card-title'>{row['customer_name']}</p>",
@@ -3010,24 +4256,22 @@ def render_search_tab():
                         unsafe_allow_html=True,
                     )
                 # Actions: force single horizontal row using 4 columns
-                rid = int(row["id"])
                 a1, a2, a3, a4, a5 = st.columns([1, 1, 1, 1, 1])
                 with a1:
                     if st.button("👁️  Preview", key=f"m_prev_{rid}", use_container_width=True):
                         st.session_state["preview_id"] = rid
                         st.session_state.pop("selected_edit_id", None)
                 with a2:
-                    if pdf_path and os.path.exists(pdf_path):
+                    if have_pdf:
                         try:
-                            with open(pdf_path, "rb") as f:
-                                st.download_button(
-                                    "⬇️  Download",
-                                    data=f.read(),
-                                    file_name=os.path.basename(pdf_path),
-                                    mime="application/pdf",
-                                    key=f"m_dl_{rid}",
-                                    use_container_width=True,
-                                )
+                            st.download_button(
+                                "⬇️  Download",
+                                data=_file_bytes(pdf_path),
+                                file_name=pdf_name,
+                                mime="application/pdf",
+                                key=f"m_dl_{rid}",
+                                use_container_width=True,
+                            )
                         except Exception:
                             st.button("⬇️  Download", disabled=True, key=f"m_dl_dis_{rid}", use_container_width=True)
                     else:
@@ -3037,39 +4281,32 @@ def render_search_tab():
                         st.session_state["selected_edit_id"] = rid
                         st.session_state.pop("preview_id", None)
                 with a4:
-                    if pdf_path and os.path.exists(pdf_path):
-                        _render_mobile_share_button(pdf_path, os.path.basename(pdf_path))
+                    if have_pdf:
+                        _render_mobile_share_button(pdf_path, pdf_name)
                     else:
                         st.button("Share PDF", disabled=True, key=f"m_share_na_{rid}", use_container_width=True)
                 with a5:
                     if st.button("🗑️  Delete", key=f"m_del_{rid}", use_container_width=True):
                         delete_invoice(rid)
+                        _selected_invoices().discard(rid)
                         st.success("Deleted.")
                         st.rerun()
 
                 # Compact details with View more (show all key fields)
-                with st.expander("View details", expanded=False):
-                    rec = fetch_full_record(rid) or {}
-                    def v(key):
-                        return rec.get(key, "")
-                    st.markdown(f"**Quotation No (auto)**: {v('quotation_no')}")
-                    st.markdown(f"**Product & Service**: {v('product')}")
-                    st.markdown(f"**Customer Name**: {v('customer_name')}")
-                    st.markdown(f"**Mobile Number**: {v('mobile')}")
-                    st.markdown(f"**Location**: {v('location')}")
-                    st.markdown(f"**City**: {v('city')}")
-                    st.markdown(f"**State**: {v('state')}")
-                    st.markdown(f"**Pincode**: {v('pincode')}")
-                    st.markdown(f"**Staff Name (kept only in DB)**: {v('staff_name')}")
-                    st.markdown(f"**Date of Quotation**: {v('date_of_quotation')}")
-                    st.markdown(f"**Validity**: {v('validity_date')}")
+                # A toggle instead of st.expander: expander bodies run even when collapsed
+                if st.toggle("View details", key=f"details_open_{rid}"):
+                    rec = page_records.get(rid) or fetch_full_record(rid) or {}
+                    # One markdown element (paragraph per field) instead of eleven
+                    st.markdown("\n\n".join(
+                        f"**{label}**: {rec.get(key, '')}" for label, key in _DETAIL_FIELDS
+                    ))
 
                 # Inline PDF preview (if chosen)
-                if st.session_state.get("preview_id") == int(row["id"]) and pdf_path and os.path.exists(pdf_path):
+                if st.session_state.get("preview_id") == int(row["id"]) and have_pdf:
                     _render_pdf_preview(pdf_path, height=480)
                     if st.button("Close preview", key=f"m_close_prev_{row['id']}"):
                         st.session_state.pop("preview_id", None)
-                        st.rerun()
+                        _rerun_fragment()
 
                 # Inline share prompt removed; Share PDF button is now directly in the action row
 
@@ -3081,14 +4318,15 @@ def render_search_tab():
                     with c_cancel:
                         if st.button("Close", key=f"close_edit_inline_{row['id']}"):
                             st.session_state.pop("selected_edit_id", None)
-                            st.rerun()
+                            _rerun_fragment()
                     render_create_form(prefill=prefill, edit_id=int(row["id"]))
 
+        _page_controls("results_page", page, pages)
         return
 
     # Desktop-like table layout with single Action column (previous behavior)
     # Header
-    h1, h2, h3, h4, h5 = st.columns([2.5, 2.5, 2, 2, 2])
+    _, h1, h2, h3, h4, h5 = st.columns(INVOICE_HEADER_SPEC)
     with h1:
         st.markdown("**Customer**")
     with h2:
@@ -3101,10 +4339,14 @@ def render_search_tab():
         st.markdown("**Action**")
 
     # Rows
-    for _, row in filtered.iterrows():
+    for row in view:
         rid = int(row["id"])
-        pdf_path = row.get("pdf_path") if "pdf_path" in row else None
-        c1, c2, c3, c4, c5 = st.columns([2.5, 2.5, 2, 2, 2])
+        pdf_path = row.get("pdf_path")
+        have_pdf = file_exists(pdf_path)
+        pdf_name = os.path.basename(pdf_path) if have_pdf else ""
+        c0, c1, c2, c3, c4, a1, a2, a3, a4, a5 = st.columns(INVOICE_ROW_SPEC)
+        with c0:
+            _select_checkbox(rid, show_label=False)
         with c1:
             st.write(row["customer_name"])  
         with c2:
@@ -3113,41 +4355,38 @@ def render_search_tab():
             st.write(row["date_of_quotation"]) 
         with c4:
             st.write(row["quotation_no"]) 
-        with c5:
-            a1, a2, a3, a4, a5 = st.columns([1, 1, 1, 1, 1])
-            with a1:
-                if st.button("👁️", key=f"d_prev_{rid}", use_container_width=True):
-                    st.session_state["preview_id"] = rid
-                    st.session_state.pop("selected_edit_id", None)
-            with a2:
-                if pdf_path and os.path.exists(pdf_path):
-                    with open(pdf_path, "rb") as f:
-                        st.download_button("⬇️", f.read(), file_name=os.path.basename(pdf_path), key=f"d_dl_{rid}", use_container_width=True)
-                else:
-                    st.button("⬇️", disabled=True, key=f"d_dl_na_{rid}", use_container_width=True)
-            with a3:
-                if st.button("✏️", key=f"d_edit_{rid}", use_container_width=True):
-                    st.session_state["selected_edit_id"] = rid
-                    st.session_state.pop("preview_id", None)
-                    st.rerun()
-            with a4:
-                if pdf_path and os.path.exists(pdf_path):
-                    _render_mobile_share_button(pdf_path, os.path.basename(pdf_path))
-                else:
-                    st.button("Share PDF", disabled=True, key=f"d_share_na_{rid}", use_container_width=True)
-            with a5:
-                if st.button("🗑️", key=f"d_del_{rid}", use_container_width=True):
-                    delete_invoice(rid)
-                    st.success("Deleted.")
-                    st.rerun()
+        with a1:
+            if st.button("👁️", key=f"d_prev_{rid}", use_container_width=True):
+                st.session_state["preview_id"] = rid
+                st.session_state.pop("selected_edit_id", None)
+        with a2:
+            if have_pdf:
+                st.download_button("⬇️", _file_bytes(pdf_path), file_name=pdf_name, key=f"d_dl_{rid}", use_container_width=True)
+            else:
+                st.button("⬇️", disabled=True, key=f"d_dl_na_{rid}", use_container_width=True)
+        with a3:
+            if st.button("✏️", key=f"d_edit_{rid}", use_container_width=True):
+                st.session_state["selected_edit_id"] = rid
+                st.session_state.pop("preview_id", None)
+                _rerun_fragment()
+        with a4:
+            if have_pdf:
+                _render_mobile_share_button(pdf_path, pdf_name)
+            else:
+                st.button("Share PDF", disabled=True, key=f"d_share_na_{rid}", use_container_width=True)
+        with a5:
+            if st.button("🗑️", key=f"d_del_{rid}", use_container_width=True):
+                delete_invoice(rid)
+                st.success("Deleted.")
+                st.rerun()
 
         # Inline preview right under the targeted row (desktop view), same as mobile behavior
-        if st.session_state.get("preview_id") == rid and pdf_path and os.path.exists(pdf_path):
+        if st.session_state.get("preview_id") == rid and have_pdf:
             with st.container():
                 _render_pdf_preview(pdf_path, height=480)
                 if st.button("Close preview", key=f"d_close_preview_{rid}"):
                     st.session_state.pop("preview_id", None)
-                    st.rerun()
+                    _rerun_fragment()
 
         # Inline share prompt removed; Share PDF is now directly in the action row (desktop view)
 
@@ -3160,41 +4399,52 @@ def render_search_tab():
                 with c_cancel:
                     if st.button("Close", key=f"d_close_edit_{rid}"):
                         st.session_state.pop("selected_edit_id", None)
-                        st.rerun()
+                        _rerun_fragment()
                 render_create_form(prefill=prefill, edit_id=rid)
 
+    _page_controls("results_page", page, pages)
+
     # Global preview/edit panels are intentionally removed for desktop table view to keep UI inline per row
 
 
+_RECORD_COLUMNS = (
+    "id", "quotation_no", "product", "customer_name", "mobile", "location", "city", "state", "pincode",
+    "staff_name", "date_of_quotation", "validity_date", "application_reference", "electricity_connection_no",
+)
+# Fixed SQL text, so sqlite3's per-connection statement cache reuses the prepared statement
+_RECORD_SELECT = f"SELECT {', '.join(_RECORD_COLUMNS)} FROM invoices"
+
+
 def fetch_full_record(inv_id: int) -> Optional[Dict[str, str]]:
-    conn = get_conn()
-    try:
+    """Invoice row as a dict (cached per id until the next invoice write)."""
+    return _fetch_full_record_cached(_invoices_gen(), int(inv_id))
+
+
+@st.cache_data(show_spinner=False, ttl=300, max_entries=256)
+def _fetch_full_record_cached(gen: int, inv_id: int) -> Optional[Dict[str, str]]:
+    with get_reader() as conn:
         cur = conn.cursor()
-        cur.execute(
-            "SELECT id, quotation_no, product, customer_name, mobile, location, city, state, pincode, staff_name, date_of_quotation, validity_date, application_reference, electricity_connection_no FROM invoices WHERE id=?",
-            (inv_id,),
-        )
-        r = cur.fetchone()
-        if not r:
-            return None
-        return {
-            "id": r[0],
-            "quotation_no": r[1],
-            "product": r[2],
-            "customer_name": r[3],
-            "mobile": r[4],
-            "location": r[5],
-            "city": r[6],
-            "state": r[7],
-            "pincode": r[8],
-            "staff_name": r[9],
-            "date_of_quotation": r[10],
-            "validity_date": r[11],
-            "application_reference": r[12],
-            "electricity_connection_no": r[13],
-        }
-    finally:
-        conn.close()
+        cur.row_factory = sqlite3.Row
+        r = cur.execute(f"{_RECORD_SELECT} WHERE id=?", (inv_id,)).fetchone()
+    return dict(r) if r else None
+
+
+def fetch_records_bulk(ids: List[int]) -> Dict[int, Dict[str, str]]:
+    """Full records for several invoices in one query, keyed by id (e.g. a results page)."""
+    return _fetch_records_bulk_cached(_invoices_gen(), tuple(sorted({int(i) for i in ids})))
+
+
+@st.cache_data(show_spinner=False, ttl=300, max_entries=32)
+def _fetch_records_bulk_cached(gen: int, ids: Tuple[int, ...]) -> Dict[int, Dict[str, str]]:
+    if not ids:
+        return {}
+    with get_reader() as conn:
+        cur = conn.cursor()
+        cur.row_factory = sqlite3.Row
+        rows = cur.execute(
+            f"{_RECORD_SELECT} WHERE id IN ({','.join('?' * len(ids))})", ids
+        ).fetchall()
+    return {r["id"]: dict(r) for r in rows}
 
 
 if __name__ == "__main__":